@@ -0,0 +1,167 @@
+# Servidor HTTP local que imita a los periódicos de Extract/config.yaml.
+#
+# Para cada sitio sirve una página principal en /<sitio> con 'articles' links
+# y cada nota en /<sitio>/articles/<n>/<slug>/. El .html se arma a partir de
+# los selectores de 'queries' de cada sitio, así que HomePage y ArticlePage lo
+# leen igual que el sitio real. Títulos y cuerpos salen de los
+# clean_*_articles.csv del repositorio. Con latency cada respuesta se retrasa
+# ese número de segundos.
+#
+# Uso directo: python news_server.py --port 8000 --articles 200
+
+import argparse
+import csv
+import glob
+import html
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(_root, 'Extract'))
+
+from common import config
+
+logger = logging.getLogger(__name__)
+
+# Una parte de un selector: 'a', '.clase', 'div.clase.otra'.
+_compound = re.compile(r'^(?P<tag>[a-zA-Z][\w-]*)?(?P<classes>(\.[\w-]+)*)$')
+
+
+# Corpus por sitio: lista de (headline, text, slug) leída de los .csv limpios.
+# Los sitios sin .csv usan el corpus de todos los demás.
+def load_corpus():
+    csv.field_size_limit(sys.maxsize)
+    corpus = {}
+    for filename in sorted(glob.glob(os.path.join(_root, 'clean_*_articles.csv'))):
+        news_site_uid = os.path.basename(filename).split('_')[1]
+        with open(filename, newline = '') as f:
+            corpus[news_site_uid] = [(row['headline'], row['text'], _slug(row['url']))
+                                     for row in csv.DictReader(f)]
+
+    everything = [article for articles in corpus.values() for article in articles]
+    return {news_site_uid: corpus.get(news_site_uid, everything)
+            for news_site_uid in config()['news_sites']}
+
+
+def _slug(url):
+    parts = [part for part in url.split('/') if part]
+    return re.sub(r'[^\w-]', '', parts[-1]) if parts else 'nota'
+
+
+# Construye el .html de un elemento que cumple 'selector' (sólo selectores
+# descendientes, como los de config.yaml) con 'inner' como contenido.
+def _element(selector, inner, attrs = ''):
+    parts = selector.split()
+    markup = inner
+    for i, part in reversed(list(enumerate(parts))):
+        match = _compound.match(part)
+        if not match:
+            raise ValueError('Unsupported selector for the stand-in server: {}'.format(selector))
+        tag = match.group('tag') or 'div'
+        classes = match.group('classes').replace('.', ' ').strip()
+        class_attr = ' class="{}"'.format(classes) if classes else ''
+        extra = attrs if i == len(parts) - 1 else ''
+        markup = '<{tag}{class_attr}{extra}>{markup}</{tag}>'.format(
+            tag = tag, class_attr = class_attr, extra = extra, markup = markup)
+
+    return markup
+
+
+class NewsSiteStandIn:
+    def __init__(self, articles = 100, latency = 0.0, corpus = None):
+        self.articles = articles
+        self.latency = latency
+        self._corpus = corpus or load_corpus()
+        self._server = None
+        self.base_url = None
+
+    # URL que hay que poner como 'url' del sitio en config.yaml.
+    def site_url(self, news_site_uid):
+        return '{}/{}'.format(self.base_url, news_site_uid)
+
+    def homepage(self, news_site_uid):
+        queries = config()['news_sites'][news_site_uid]['queries']
+        corpus = self._corpus[news_site_uid]
+        links = []
+        for n in range(self.articles):
+            headline, _, slug = corpus[n % len(corpus)]
+            href = '{}/articles/{}/{}/'.format(self.site_url(news_site_uid), n, slug)
+            links.append(_element(queries['homepage_article_links'], html.escape(headline),
+                                  ' href="{}"'.format(html.escape(href))))
+
+        return '<html><body>{}</body></html>'.format(''.join(links))
+
+    def article(self, news_site_uid, n):
+        queries = config()['news_sites'][news_site_uid]['queries']
+        corpus = self._corpus[news_site_uid]
+        headline, text, _ = corpus[n % len(corpus)]
+        return '<html><body><header>Menu</header>{}{}<footer>Footer</footer></body></html>'.format(
+            _element(queries['article_title'], html.escape(headline)),
+            _element(queries['article_body'], html.escape(text)))
+
+    # Devuelve el .html de 'path' o None si no existe.
+    def page(self, path):
+        parts = [part for part in path.split('/') if part]
+        if not parts or parts[0] not in self._corpus:
+            return None
+        if len(parts) == 1:
+            return self.homepage(parts[0])
+        if len(parts) >= 3 and parts[1] == 'articles' and parts[2].isdigit() and int(parts[2]) < self.articles:
+            return self.article(parts[0], int(parts[2]))
+
+        return None
+
+    def start(self, host = '127.0.0.1', port = 0):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if stand_in.latency:
+                    time.sleep(stand_in.latency)
+                body = stand_in.page(self.path)
+                if body is None:
+                    self.send_error(404)
+                    return
+                payload = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.base_url = 'http://{}:{}'.format(*self._server.server_address[:2])
+        threading.Thread(target = self._server.serve_forever, daemon = True).start()
+        logger.info('News site stand-in listening on {}'.format(self.base_url))
+
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level = logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', help = 'Port to listen on', type = int, default = 8000)
+    parser.add_argument('--articles', help = 'Articles per site', type = int, default = 100)
+    parser.add_argument('--latency-ms', help = 'Delay added to every response', type = float, default = 0)
+    args = parser.parse_args()
+
+    stand_in = NewsSiteStandIn(args.articles, args.latency_ms / 1000).start(port = args.port)
+    for news_site_uid in config()['news_sites']:
+        logger.info('{}: {}'.format(news_site_uid, stand_in.site_url(news_site_uid)))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stand_in.stop()
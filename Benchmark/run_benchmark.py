@@ -0,0 +1,165 @@
+# Benchmark de punta a punta del ETL, sin salir a internet.
+#
+# Levanta news_server.NewsSiteStandIn, apunta cada sitio de config.yaml a él y
+# corre Extract, Transform y Load en este mismo proceso contra una base de
+# datos temporal, midiendo el tiempo de cada etapa. El resultado se compara
+# con baseline.json: si alguna etapa tarda más que la referencia por encima
+# de --tolerance, el programa termina con error; también si no existe
+# baseline.json y no se pidió --save-baseline.
+#
+# Uso:
+#   python run_benchmark.py --articles 200 --latency-ms 20 --save-baseline
+#   python run_benchmark.py --articles 200 --latency-ms 20
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+_here = os.path.dirname(os.path.abspath(__file__))
+_root = os.path.dirname(_here)
+
+sys.path.insert(0, _root)
+import pipeline
+from pipeline import extractor, loader, newspaper_recipe
+import base
+from common import config
+from news_server import NewsSiteStandIn
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASELINE = os.path.join(_here, 'baseline.json')
+STAGES = ('extract', 'transform', 'load')
+# Peticiones por segundo (y ráfaga) durante el benchmark: el servidor es local.
+UNTHROTTLED_RATE = 100000
+
+
+def run(news_sites_uids, articles, latency, workers):
+    # Cada corrida usa una base de datos temporal (y su índice de notas casi
+    # repetidas), que se borra al terminar.
+    tmp_dir = tempfile.mkdtemp(prefix = 'etl-benchmark-')
+    previous_db = os.environ.get('NEWSPAPER_DB')
+    os.environ['NEWSPAPER_DB'] = os.path.join(tmp_dir, 'newspaper.db')
+    base.Engine.dispose()
+    stand_in = NewsSiteStandIn(articles, latency).start()
+    # Todos los sitios apuntan al servidor local; el caché HTTP y el de
+    # conteos se desactivan para medir el trabajo completo en cada corrida, y
+    # el límite de peticiones por segundo se quita para que no frene a
+    # --workers.
+    for news_site_uid in news_sites_uids:
+        config()['news_sites'][news_site_uid]['url'] = stand_in.site_url(news_site_uid)
+        config()['news_sites'][news_site_uid].pop('fetch', None)
+    config().setdefault('http_cache', {})['enabled'] = False
+    config().setdefault('fetch', {}).update({'requests_per_second': UNTHROTTLED_RATE, 'burst': UNTHROTTLED_RATE})
+    newspaper_recipe.disable_token_cache()
+
+    seconds = dict.fromkeys(STAGES, 0.0)
+    rows = dict.fromkeys(STAGES, 0)
+    try:
+        for news_site_uid in news_sites_uids:
+            start = time.perf_counter()
+            fetched = extractor._news_scraper(news_site_uid, workers, save = False, incremental = False)
+            df = pipeline._articles_to_df(fetched)
+            seconds['extract'] += time.perf_counter() - start
+            rows['extract'] += len(df)
+
+            start = time.perf_counter()
+            df = newspaper_recipe.transform(df, news_site_uid)
+            seconds['transform'] += time.perf_counter() - start
+            rows['transform'] += len(df)
+
+            start = time.perf_counter()
+            # Como en pipeline._load, las notas casi repetidas se quitan al cargar.
+            with newspaper_recipe.without_near_duplicates(df) as df:
+                loader.load(df)
+            seconds['load'] += time.perf_counter() - start
+            rows['load'] += len(df)
+    finally:
+        stand_in.stop()
+        base.Engine.dispose()
+        if previous_db is None:
+            del os.environ['NEWSPAPER_DB']
+        else:
+            os.environ['NEWSPAPER_DB'] = previous_db
+        shutil.rmtree(tmp_dir, ignore_errors = True)
+
+    return {
+        'config': {'sites': list(news_sites_uids), 'articles': articles, 'latency': latency, 'workers': workers},
+        'stages': {stage: {'seconds': round(seconds[stage], 4), 'rows': rows[stage],
+                           'rows_per_second': round(rows[stage] / seconds[stage], 1) if seconds[stage] else None}
+                   for stage in STAGES},
+    }
+
+
+# Devuelve la lista de regresiones contra la referencia (vacía si no hay).
+def compare(result, baseline, tolerance):
+    regressions = []
+    for stage in STAGES:
+        current = result['stages'][stage]['seconds']
+        reference = baseline['stages'][stage]['seconds']
+        if current > reference * (1 + tolerance):
+            regressions.append('{}: {:.3f}s vs baseline {:.3f}s (+{:.0%})'.format(
+                stage, current, reference, current / reference - 1))
+
+    return regressions
+
+
+def _print_result(result):
+    print('{:<12}{:>10}{:>8}{:>12}'.format('stage', 'seconds', 'rows', 'rows/s'))
+    for stage in STAGES:
+        stats = result['stages'][stage]
+        print('{:<12}{:>10.3f}{:>8}{:>12}'.format(stage, stats['seconds'], stats['rows'], stats['rows_per_second']))
+
+
+def main(args):
+    # Sin referencia no hay contra qué comparar: es un error, no un éxito.
+    if not args.save_baseline and not os.path.exists(args.baseline):
+        print('No baseline at {}; run with --save-baseline to create one.'.format(args.baseline))
+        return 2
+
+    result = run(args.sites, args.articles, args.latency_ms / 1000, args.workers)
+    _print_result(result)
+
+    if args.save_baseline:
+        with open(args.baseline, mode = 'w') as f:
+            json.dump(result, f, indent = 2)
+        print('Baseline saved at {}'.format(args.baseline))
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline['config'] != result['config']:
+        print('Baseline was recorded with {}, not comparable with {}.'.format(baseline['config'], result['config']))
+        return 2
+
+    regressions = compare(result, baseline, args.tolerance)
+    if regressions:
+        print('PERFORMANCE REGRESSION')
+        for regression in regressions:
+            print('  ' + regression)
+        return 1
+
+    print('No regressions against {} (tolerance {:.0%}).'.format(args.baseline, args.tolerance))
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    news_site_choices = list(config()['news_sites'].keys())
+    parser.add_argument('--sites', help = 'News sites to benchmark', nargs = '+',
+                        choices = news_site_choices, default = news_site_choices)
+    parser.add_argument('--articles', help = 'Articles per site', type = int, default = 100)
+    parser.add_argument('--latency-ms', help = 'Delay added to every HTTP response', type = float, default = 0)
+    parser.add_argument('--workers', help = 'Articles fetched concurrently per site', type = int, default = 1)
+    parser.add_argument('--baseline', help = 'Baseline file', default = DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', help = 'Store this run as the baseline', action = 'store_true')
+    parser.add_argument('--tolerance', help = 'Allowed slowdown per stage (0.25 = 25%%)', type = float, default = 0.25)
+    args = parser.parse_args()
+
+    # Los mensajes por artículo de cada etapa ocultan la tabla de resultados.
+    logging.getLogger().setLevel(logging.WARNING)
+    sys.exit(main(args))
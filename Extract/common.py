@@ -1,12 +1,37 @@
+import os
+
 import yaml
 
 
 __config = None
+# Fecha de modificación de config.yaml cuando se leyó (ver reload_if_changed).
+__config_mtime = None
+# config.yaml vive junto a este módulo, así que se encuentra aunque el proceso
+# se ejecute desde otra carpeta (por ejemplo, desde pipeline.py).
+__config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.yaml')
 
 def config():
-    global __config
+    global __config, __config_mtime
     if not __config:
-        with open('config.yaml', mode = 'r') as f:
+        __config_mtime = os.path.getmtime(__config_path)
+        with open(__config_path, mode = 'r') as f:
             __config = yaml.safe_load(f)
 
-    return __config
\ No newline at end of file
+    return __config
+
+
+# Vuelve a leer config.yaml si cambió desde la última lectura y devuelve True
+# en ese caso. Lo usa el servicio de crawl_daemon.py, que no se reinicia. Si
+# el archivo nuevo no es YAML válido, se lanza el error, se conserva la
+# configuración anterior y no se vuelve a intentar hasta el siguiente cambio.
+def reload_if_changed():
+    global __config, __config_mtime
+    mtime = os.path.getmtime(__config_path)
+    if __config and mtime == __config_mtime:
+        return False
+
+    __config_mtime = mtime
+    with open(__config_path, mode = 'r') as f:
+        __config = yaml.safe_load(f)
+
+    return True
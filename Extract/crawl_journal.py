@@ -0,0 +1,73 @@
+# Diario de una extracción en curso.
+#
+# Cada artículo descargado se agrega como una línea JSON al diario del sitio y
+# se fuerza a disco (fsync) antes de pedir el siguiente, así que si el proceso
+# se cae a la mitad no se pierde lo que ya se descargó. Con --resume, main.py
+# lee el diario, omite los links que ya están en él y sigue agregando al final.
+# Cuando el archivo de salida se guarda completo, el diario se borra.
+
+import json
+import logging
+import os
+
+from news_page_objects import ArticleRecord
+
+logger = logging.getLogger(__name__)
+
+# Carpeta de los diarios, relativa a la carpeta de Extract.
+JOURNAL_DIRECTORY = '.journal'
+
+
+def journal_path(news_site_uid):
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), JOURNAL_DIRECTORY)
+    return os.path.join(directory, '{}.jsonl'.format(news_site_uid))
+
+
+class CrawlJournal:
+    def __init__(self, path):
+        self._path = path
+        self._file = None
+
+    # Abre el diario para agregar artículos. Con resume devuelve los artículos
+    # que ya tenía; si no, lo vacía y devuelve una lista vacía. Una última
+    # línea incompleta (el proceso murió mientras la escribía) se descarta.
+    def open(self, resume = False):
+        articles = []
+        valid_bytes = 0
+        if resume and os.path.exists(self._path):
+            with open(self._path, mode = 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        fields = json.loads(line)
+                    except ValueError:
+                        break
+                    articles.append(ArticleRecord(*(fields[name] for name in ArticleRecord._fields)))
+                    valid_bytes += len(line)
+            logger.info('Resuming with {} articles from {}'.format(len(articles), self._path))
+
+        os.makedirs(os.path.dirname(self._path), exist_ok = True)
+        self._file = open(self._path, mode = 'ab')
+        self._file.truncate(valid_bytes)
+
+        return articles
+
+    def append(self, article):
+        line = json.dumps(article._asdict(), ensure_ascii = False) + '\n'
+        self._file.write(line.encode('utf-8'))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # Cierra y borra el diario cuando la extracción terminó bien.
+    def discard(self):
+        self.close()
+        try:
+            os.remove(self._path)
+        except FileNotFoundError:
+            pass
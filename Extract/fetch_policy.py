@@ -0,0 +1,191 @@
+# Política de descarga por sitio: timeouts, reintentos con backoff
+# exponencial y jitter, límite de peticiones por segundo (token bucket) que se
+# adapta a las respuestas 429/503, y un circuit breaker que deja de intentar
+# con un sitio que falla una y otra vez.
+#
+# FetchPolicy.get tiene la misma forma que requests.Session.get, así que se
+# puede usar en lugar de la sesión (por ejemplo, desde HttpCache).
+
+import email.utils
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+from requests.exceptions import ConnectionError, HTTPError, Timeout
+
+# metrics.py vive en la raíz del repositorio.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Valores por defecto de la sección 'fetch' de config.yaml.
+DEFAULTS = {
+    'connect_timeout': 5,
+    'read_timeout': 30,
+    'max_retries': 3,
+    'backoff_base': 0.5,
+    'backoff_max': 30,
+    'requests_per_second': 10,
+    'burst': 10,
+    'circuit_breaker_failures': 10,
+    'circuit_breaker_cooldown': 300,
+}
+
+# Respuestas que se reintentan. Con 429 y 503 además se baja el ritmo.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+THROTTLE_STATUSES = (429, 503)
+
+
+# Se lanza cuando el circuit breaker del sitio está abierto. Hereda de
+# HTTPError para que _fetch_article la trate como una página fallida.
+class CircuitOpenError(HTTPError):
+    pass
+
+
+# Token bucket: permite 'burst' peticiones seguidas y luego 'rate' por
+# segundo. throttle() reduce el ritmo a la mitad y recover() lo va subiendo
+# de nuevo hasta max_rate.
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.max_rate = rate
+        self.rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait)
+
+    # El servidor pidió bajar el ritmo; retry_after (segundos) pausa el bucket.
+    def throttle(self, retry_after = None):
+        with self._lock:
+            self.rate = max(self.max_rate / 64, self.rate / 2)
+            if retry_after:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+    def recover(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate * 1.1)
+
+
+# Circuit breaker: después de 'threshold' fallas seguidas se abre y rechaza
+# peticiones durante 'cooldown' segundos; luego deja pasar una de prueba.
+class CircuitBreaker:
+    def __init__(self, threshold, cooldown):
+        self._threshold = threshold
+        self._cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def check(self, name):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at >= self._cooldown:
+                # Medio abierto: se permite un intento; si falla, se vuelve a abrir.
+                self._opened_at = None
+                self._failures = self._threshold - 1
+                return
+
+        raise CircuitOpenError('Circuit open for {}, skipping request'.format(name))
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+
+    def failure(self, name):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self._threshold and self._opened_at is None:
+                self._opened_at = time.monotonic()
+                logger.warning('Circuit opened for {} after {} consecutive failures'.format(name, self._failures))
+
+
+class FetchPolicy:
+    def __init__(self, name, session, settings):
+        settings = dict(DEFAULTS, **(settings or {}))
+        self._name = name
+        self._session = session
+        self._timeout = (settings['connect_timeout'], settings['read_timeout'])
+        self._max_retries = settings['max_retries']
+        self._backoff_base = settings['backoff_base']
+        self._backoff_max = settings['backoff_max']
+        self._bucket = TokenBucket(settings['requests_per_second'], settings['burst'])
+        self._breaker = CircuitBreaker(settings['circuit_breaker_failures'], settings['circuit_breaker_cooldown'])
+
+    # Hace la petición aplicando la política. Devuelve la última respuesta
+    # (quien llama decide con raise_for_status) o lanza la última excepción
+    # de conexión si ningún intento obtuvo respuesta.
+    def get(self, url, headers = None, **kwargs):
+        kwargs.setdefault('timeout', self._timeout)
+        host = urlparse(url).netloc
+
+        for attempt in range(self._max_retries + 1):
+            self._breaker.check(self._name)
+            self._bucket.acquire()
+
+            retry_after = None
+            try:
+                response = self._session.get(url, headers = headers, **kwargs)
+            except (ConnectionError, Timeout) as e:
+                error, response = e, None
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    self._breaker.success()
+                    self._bucket.recover()
+                    return response
+                error = None
+                if response.status_code in THROTTLE_STATUSES:
+                    retry_after = _retry_after(response)
+                    self._bucket.throttle(retry_after)
+
+            self._breaker.failure(self._name)
+            if attempt == self._max_retries:
+                break
+
+            delay = min(self._backoff_max, retry_after) if retry_after else self._backoff(attempt)
+            logger.info('Retrying {} in {:.1f}s ({})'.format(url, delay, error or response.status_code))
+            metrics.inc('etl_fetch_retries', host = host)
+            time.sleep(delay)
+
+        if response is None:
+            raise error
+        return response
+
+    # Backoff exponencial con jitter completo: un valor al azar entre 0 y
+    # backoff_base * 2^attempt (con tope backoff_max).
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self._backoff_max, self._backoff_base * 2 ** attempt))
+
+
+# Segundos indicados por la cabecera Retry-After (número o fecha HTTP).
+def _retry_after(response):
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    if value.isdigit():
+        return int(value)
+
+    try:
+        moment = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0, moment.timestamp() - time.time())
@@ -0,0 +1,138 @@
+# Caché HTTP en disco para las páginas que visita NewsPage.
+#
+# Cada respuesta 200 se guarda en un archivo junto con sus cabeceras ETag y
+# Last-Modified. En la siguiente visita se hace una petición condicional
+# (If-None-Match / If-Modified-Since) y, si el servidor responde 304, se usa el
+# cuerpo guardado. El índice vive en un SQLite dentro de la carpeta del caché;
+# cuando el total supera max_bytes se borran las entradas usadas hace más
+# tiempo (LRU). En modo offline no se toca la red: sólo se sirve lo guardado.
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from requests.exceptions import HTTPError
+
+
+# Se lanza en modo offline cuando la url no está en el caché. Hereda de
+# HTTPError para que _fetch_article la trate como cualquier página fallida.
+class CacheMiss(HTTPError):
+    pass
+
+
+class HttpCache:
+    def __init__(self, directory, max_bytes, offline = False):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self.offline = offline
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok = True)
+        # Un mismo caché se usa desde los hilos de _fetch_articles, así que la
+        # conexión se comparte y se protege con el lock.
+        self._db = sqlite3.connect(os.path.join(directory, 'index.db'), check_same_thread = False)
+        self._db.execute('''CREATE TABLE IF NOT EXISTS entries (
+                                url TEXT PRIMARY KEY,
+                                etag TEXT,
+                                last_modified TEXT,
+                                size INTEGER NOT NULL,
+                                last_access REAL NOT NULL)''')
+        self._db.commit()
+
+    # Devuelve el cuerpo de 'url' como texto utf-8, usando el caché si el
+    # servidor confirma que no ha cambiado. 'session' es cualquier objeto con
+    # el método get de requests.Session (por ejemplo, una FetchPolicy).
+    def get(self, session, url, **kwargs):
+        entry = self._entry(url)
+
+        if self.offline:
+            body = self._hit(url) if entry is not None else None
+            if body is None:
+                raise CacheMiss('{} is not in the HTTP cache'.format(url))
+            return body
+
+        headers = {}
+        if entry is not None:
+            etag, last_modified = entry
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        response = session.get(url, headers = headers, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            body = self._hit(url)
+            if body is not None:
+                return body
+            # El archivo ya no estaba (otro proceso lo borró, por ejemplo): se
+            # pide de nuevo la página completa, sin validadores.
+            response = session.get(url, **kwargs)
+
+        # Protección en caso de que la página no permita el acceso.
+        response.raise_for_status()
+        self._store(url, response)
+        response.encoding = 'utf-8'
+
+        return response.text
+
+    def _entry(self, url):
+        with self._lock:
+            return self._db.execute('SELECT etag, last_modified FROM entries WHERE url = ?', (url,)).fetchone()
+
+    def _path(self, url):
+        return os.path.join(self._directory, hashlib.sha1(url.encode()).hexdigest())
+
+    # Lee el cuerpo guardado y marca la entrada como usada recientemente. Si
+    # el archivo no existe, borra la entrada y devuelve None.
+    def _hit(self, url):
+        try:
+            with open(self._path(url), mode = 'rb') as f:
+                body = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self._db.execute('DELETE FROM entries WHERE url = ?', (url,))
+                self._db.commit()
+            return None
+
+        with self._lock:
+            self._db.execute('UPDATE entries SET last_access = ? WHERE url = ?', (time.time(), url))
+            self._db.commit()
+
+        return body.decode('utf-8', errors = 'replace')
+
+    # Guarda el cuerpo y las cabeceras de validación, y luego aplica el límite
+    # de tamaño.
+    def _store(self, url, response):
+        body = response.content
+        # Se escribe en un temporal y se renombra para que un proceso que lea
+        # al mismo tiempo nunca vea un archivo a medias.
+        path = self._path(url)
+        tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(tmp_path, mode = 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                             (url, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                              len(body), time.time()))
+            self._evict()
+            self._db.commit()
+
+    # Borra las entradas menos usadas hasta que el caché quepa en max_bytes.
+    # Se llama con el lock tomado.
+    def _evict(self):
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self._max_bytes:
+            return
+
+        for url, size in self._db.execute('SELECT url, size FROM entries ORDER BY last_access').fetchall():
+            if total <= self._max_bytes:
+                break
+            self._db.execute('DELETE FROM entries WHERE url = ?', (url,))
+            try:
+                os.remove(self._path(url))
+            except FileNotFoundError:
+                pass
+            total -= size
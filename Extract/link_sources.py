@@ -0,0 +1,204 @@
+# Fuentes de links de artículos de cada sitio.
+#
+# Por defecto los links salen de la página principal (HomePage). Un sitio
+# puede declarar en config.yaml, en 'link_sources', una lista de fuentes:
+#
+#     link_sources:
+#             - type: sitemap
+#               url: https://www.example.com/sitemap.xml
+#             - type: rss
+#               url: https://www.example.com/rss
+#             - type: homepage
+#
+# Los sitemaps (incluidos los índices de sitemaps) y los feeds RSS o Atom se
+# leen con iterparse, elemento por elemento, sin construir el documento
+# completo en memoria. Cada entrada trae su fecha (lastmod, pubDate, updated);
+# las que no cambiaron desde la última corrida del sitio se omiten. La fecha
+# de la última corrida se guarda en LAST_RUN_DIRECTORY con Watermark.commit,
+# sólo si todas las fuentes y descargas funcionaron y los artículos ya se
+# guardaron o cargaron; si no, la fecha no avanza y el índice de artículos
+# vistos (seen_index) evita repetir las descargas.
+
+import datetime
+import email.utils
+import logging
+import os
+from xml.etree.ElementTree import ParseError, iterparse
+
+from requests.exceptions import RequestException
+
+from common import config
+import news_page_objects as news
+
+logger = logging.getLogger(__name__)
+
+SOURCE_TYPES = ('homepage', 'sitemap', 'rss')
+# Carpeta (relativa a Extract) con la fecha de la última corrida de cada sitio.
+LAST_RUN_DIRECTORY = '.last_run'
+# Profundidad máxima al seguir índices de sitemaps.
+MAX_SITEMAP_DEPTH = 2
+
+
+# Devuelve el conjunto de links de todas las fuentes del sitio. Con 'since'
+# (datetime con zona horaria) sólo se incluyen las entradas de sitemaps y
+# feeds con fecha posterior; las que no traen fecha siempre se incluyen. Una
+# fuente que falla se registra, se omite y se anota en 'watermark'.
+def article_links(news_site_uid, since = None, watermark = None):
+    site_config = config()['news_sites'][news_site_uid]
+    sources = site_config.get('link_sources') or [{'type': 'homepage'}]
+
+    links = set()
+    for source in sources:
+        source_type = source['type']
+        try:
+            if source_type == 'homepage':
+                found = news.HomePage(news_site_uid, site_config['url']).article_links
+            elif source_type == 'sitemap':
+                found = set(_sitemap_links(news_site_uid, source['url'], since))
+            elif source_type == 'rss':
+                found = set(_feed_links(news_site_uid, source['url'], since))
+            else:
+                raise ValueError('Unknown link source type {!r}, expected one of {}'.format(
+                    source_type, SOURCE_TYPES))
+        except (RequestException, ParseError) as e:
+            logger.warning('Link source {} {} failed: {}'.format(source_type, source.get('url', ''), e))
+            if watermark is not None:
+                watermark.fail()
+            continue
+
+        logger.info('{} links from {} {}'.format(len(found), source_type, source.get('url', '')))
+        links.update(found)
+
+    return links
+
+
+# Fecha de la última corrida completa del sitio, o None si no hay.
+def last_run(news_site_uid):
+    try:
+        with open(_last_run_path(news_site_uid)) as f:
+            return _parse_date(f.read().strip())
+    except FileNotFoundError:
+        return None
+
+
+# Corrida de un sitio: guarda la hora en que empezó y si algo falló. Se pasa
+# a _iter_articles y quien guarda o carga los artículos llama a commit al
+# terminar. Viaja entre procesos del pool de pipeline.py, así que no guarda
+# nada más que datos simples.
+class Watermark:
+    def __init__(self, news_site_uid):
+        self.news_site_uid = news_site_uid
+        self.started = datetime.datetime.now(datetime.timezone.utc)
+        self.complete = True
+
+    def fail(self):
+        self.complete = False
+
+    # Avanza la última corrida del sitio sólo si la extracción estuvo completa.
+    def commit(self):
+        if not self.complete:
+            logger.info('Some links or articles of {} failed, last run left unchanged'.format(self.news_site_uid))
+            return False
+
+        mark_run(self.news_site_uid, self.started)
+        return True
+
+
+# Guarda 'moment' (por ejemplo, la hora en que empezó la extracción) como
+# la última corrida del sitio.
+def mark_run(news_site_uid, moment):
+    path = _last_run_path(news_site_uid)
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, mode = 'w') as f:
+        f.write(moment.isoformat())
+    os.replace(tmp_path, path)
+
+
+def _last_run_path(news_site_uid):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), LAST_RUN_DIRECTORY, news_site_uid)
+
+
+# Nombre de la etiqueta sin el espacio de nombres ('{http://...}loc' -> 'loc').
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+# Entradas (tipo, url, fecha) de un sitemap: 'url' para páginas y 'sitemap'
+# para los sitemaps hijos de un índice.
+def _sitemap_entries(stream):
+    loc = date = None
+    for event, element in iterparse(stream, events = ('start', 'end')):
+        name = _local(element.tag)
+        if event == 'start':
+            if name in ('url', 'sitemap'):
+                loc = date = None
+        elif name == 'loc':
+            loc = (element.text or '').strip()
+        elif name in ('lastmod', 'publication_date') and date is None:
+            date = _parse_date(element.text)
+        elif name in ('url', 'sitemap'):
+            if loc:
+                yield name, loc, date
+            element.clear()
+
+
+# Las entradas se leen completas antes de abrir los sitemaps hijos para no
+# ocupar dos lugares del límite por host a la vez.
+def _sitemap_links(news_site_uid, url, since, depth = 0):
+    with news.open_feed(news_site_uid, url) as stream:
+        entries = list(_sitemap_entries(stream))
+
+    for kind, loc, date in entries:
+        if since is not None and date is not None and date <= since:
+            continue
+        if kind == 'url':
+            yield loc
+        elif depth < MAX_SITEMAP_DEPTH:
+            yield from _sitemap_links(news_site_uid, loc, since, depth + 1)
+
+
+# Links de un feed RSS (item/link, pubDate) o Atom (entry/link href,
+# updated o published). Los datos se reinician al abrir cada item para no
+# tomar el link o la fecha del canal.
+def _feed_links(news_site_uid, url, since):
+    with news.open_feed(news_site_uid, url) as stream:
+        link = date = None
+        for event, element in iterparse(stream, events = ('start', 'end')):
+            name = _local(element.tag)
+            if event == 'start':
+                if name in ('item', 'entry'):
+                    link = date = None
+            elif name == 'link':
+                href = element.get('href')
+                if href and element.get('rel', 'alternate') == 'alternate':
+                    link = href
+                elif not href and element.text:
+                    link = element.text.strip()
+            elif name in ('pubDate', 'updated', 'published', 'date') and date is None:
+                date = _parse_date(element.text)
+            elif name in ('item', 'entry'):
+                if link and (since is None or date is None or date > since):
+                    yield link
+                element.clear()
+
+
+# Convierte una fecha W3C/ISO 8601 (sitemaps, Atom) o RFC 822 (RSS) en un
+# datetime con zona horaria (UTC si no trae). Devuelve None si no se entiende.
+def _parse_date(value):
+    value = (value or '').strip()
+    if not value:
+        return None
+
+    try:
+        moment = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        try:
+            moment = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo = datetime.timezone.utc)
+
+    return moment
@@ -4,55 +4,130 @@ import news_page_objects as news
 import re
 import datetime
 import csv
+import os
+from concurrent.futures import ThreadPoolExecutor
 
-from requests.exceptions import HTTPError
+from requests.exceptions import RequestException
 from urllib3.exceptions import MaxRetryError
 
 logging.basicConfig(level=logging.INFO)
 
 from common import config
+from crawl_journal import CrawlJournal, journal_path
+import link_sources
+from seen_index import SeenIndex
 
 logger = logging.getLogger(__name__)
 # RegEx
 is_well_formed_link = re.compile(r'^https?://.+/.+$') # https://example.com/hello
 is_root_path = re.compile(r'^/.+$') # /some-text
 
-# Núcleo del proceso de scraping.
-def _news_scraper(news_site_uid):
-    articles = []
+# Columnas (todas de texto) de los archivos de Extract, en el orden de
+# ArticleRecord.
+ARTICLE_SCHEMA = news.ArticleRecord._fields
+FILE_FORMATS = ('csv', 'parquet', 'feather')
+
+# Núcleo del proceso de scraping. Con workers > 1 los artículos se descargan en
+# paralelo; el límite por host lo impone NewsPage._visit. Con incremental, se
+# omiten los links que ya están en la base de datos. Devuelve la lista de
+# artículos y, si save es True, también los guarda en un archivo file_format.
+# Al guardar, cada artículo se anota primero en el diario del sitio (ver
+# crawl_journal); con resume se retoma la extracción que quedó a medias.
+# 'watermark' (link_sources.Watermark) registra si algo falló; si no se pasa y
+# la corrida es incremental con save, se crea aquí y se confirma después de
+# guardar el archivo.
+def _news_scraper(news_site_uid, workers = 1, save = True, incremental = True, file_format = 'csv',
+                  resume = False, watermark = None):
+    journal = CrawlJournal(journal_path(news_site_uid)) if save else None
+    articles = journal.open(resume) if journal else []
+    skip = {article.url for article in articles}
+    commit = watermark is None and save and incremental
+    if commit:
+        watermark = link_sources.Watermark(news_site_uid)
+
+    try:
+        for article in _iter_articles(news_site_uid, workers, incremental, skip, watermark):
+            articles.append(article)
+            if journal:
+                journal.append(article)
+    finally:
+        if journal:
+            journal.close()
+
+    #print(len(articles))
+    if save:
+        _save_articles(news_site_uid, articles, file_format)
+        journal.discard()
+    if commit:
+        watermark.commit()
+
+    return articles
+
+
+# Genera los artículos válidos de un sitio conforme se van descargando, sin
+# esperar a tenerlos todos. Lo usa el modo streaming de pipeline.py. Los links
+# salen de las fuentes del sitio (ver link_sources); con incremental, de los
+# sitemaps y feeds sólo se toman las entradas nuevas desde la última corrida.
+# Los links cuya url está en 'skip' no se descargan. Las fuentes y descargas
+# que fallan se anotan en 'watermark'; quien llama decide cuándo confirmarla
+# (después de guardar o cargar los artículos).
+def _iter_articles(news_site_uid, workers = 1, incremental = True, skip = (), watermark = None):
     # El host guarda la url dentro de la llave news_site_uid (corresponde a los 
     # periódicos) que se encuentra en la llave 'news_site'.
     host = config()['news_sites'][news_site_uid]['url']
     # Muestra en pantalla el mensaje indicado.
     logging.info('Launching scraper for {}'.format(host))
-    # homepage es un objeto tipo HomePage, que recibe el nombre del sitio y su url.
-    homepage = news.HomePage(news_site_uid, host)
+    since = link_sources.last_run(news_site_uid) if incremental else None
+    seen = _seen_index() if incremental else None
+    links = [link for link in link_sources.article_links(news_site_uid, since, watermark)
+             if _build_link(host, link) not in skip]
 
-    for link in homepage.article_links:
-        #print(link)
-        article = _fetch_article(news_site_uid, host, link)
-
-        # Si se guardó un cuerpo, se guarda en la lista articles.
+    for article in _fetch_articles(news_site_uid, host, links, workers, seen, watermark):
+        # Si se guardó un cuerpo, se entrega el artículo.
         if article:
             logger.info('Article fetched!!!')
-            articles.append(article)
-            #break
-            #print(article.title)
+            yield article
 
-    #print(len(articles))
-    _save_articles(news_site_uid, articles)
+
+# Descarga los artículos de 'links', uno por uno o con un pool de hilos.
+# En ambos casos se entregan en el mismo orden que los links (o None si
+# no se pudieron obtener), así que el resultado es el mismo que en serie.
+def _fetch_articles(news_site_uid, host, links, workers = 1, seen = None, watermark = None):
+    links = list(links)
+    if workers <= 1:
+        for link in links:
+            yield _fetch_article(news_site_uid, host, link, seen, watermark)
+        return
+
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        yield from executor.map(lambda link: _fetch_article(news_site_uid, host, link, seen, watermark), links)
 
 
-# Guardar en un .csv todos los artículos de un sitio.
-def _save_articles(news_site_uid, articles):
+# Índice de las uids que ya están en la tabla 'articles'. La ruta de la base de
+# datos es la de NEWSPAPER_DB (la misma que usa Load) o, si no está definida,
+# 'articles_database' en config.yaml, relativa a esta carpeta.
+def _seen_index():
+    db_path = os.environ.get('NEWSPAPER_DB') or os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                             config()['articles_database'])
+    return SeenIndex.from_database(db_path)
+
+
+# Guardar en un .csv (o .parquet/.feather) todos los artículos de un sitio.
+def _save_articles(news_site_uid, articles, file_format = 'csv'):
     # Guarda la fecha de este momento en 'now' con el formato dd-mm-aa.
     now = datetime.datetime.now().strftime('%d-%m-%Y')
     # Crea el archivo con el formato 'sitio_fecha_articles.csv'.
-    out_file_name = '{news_site_uid}_{datetime}_articles.csv'.format(news_site_uid = news_site_uid, datetime = now)
-    # Crea una lista que serán las cabeceras de columnas en el .csv.
-    # Filtra los métodos (aplicables a articles, función dir())y mantiene los que no 
-    # empiezan con '_', es decir title y body. El iterador se convierte a lista con list().
-    csv_headers = list(filter(lambda property: not property.startswith('_'), dir(articles[0])))
+    out_file_name = '{news_site_uid}_{datetime}_articles.{extension}'.format(
+        news_site_uid = news_site_uid, datetime = now, extension = file_format)
+    if not articles:
+        logger.warning('No articles fetched for {}, nothing to save'.format(news_site_uid))
+        return
+    if file_format != 'csv':
+        _save_articles_arrow(out_file_name, articles, file_format)
+        return
+
+    # Las cabeceras de columnas en el .csv son los campos de ArticleRecord.
+    csv_headers = ARTICLE_SCHEMA
     # Crea el archivo con nombre 'out_file_name', con función de escritura que permite
     # edición (+).
     with open(out_file_name, mode = 'w+') as f:
@@ -63,26 +138,54 @@ def _save_articles(news_site_uid, articles):
 
         # Agrega una fila para cada artículo
         for article in articles:
-            # Obtiene el atributo para cada title y body (prop in csv_headers) y lo
-            # convierte en cadena de texto.
-            row = [str(getattr(article, prop)) for prop in csv_headers]
+            # Convierte cada campo del artículo (en el orden de csv_headers) en
+            # cadena de texto.
+            row = [str(value) for value in article]
             # Escribe a fuego la fila equivalente a noticia, título y cuerpo.
             writer.writerow(row)
 
 
-# Función para extraer título y cuerpo de cada artículo.
-def _fetch_article(news_site_uid, host, link):
+# Guarda los artículos en parquet o feather con el esquema de ARTICLE_SCHEMA.
+# Los títulos vacíos se guardan como nulos, que es como pd.read_csv los lee
+# del .csv y como newspaper_recipe los espera.
+def _save_articles_arrow(out_file_name, articles, file_format):
+    import pyarrow as pa
+    from pyarrow import feather, parquet
+
+    schema = pa.schema([(name, pa.string()) for name in ARTICLE_SCHEMA])
+    columns = {name: [getattr(article, name) or None for article in articles] for name in ARTICLE_SCHEMA}
+    table = pa.Table.from_pydict(columns, schema = schema)
+
+    if file_format == 'parquet':
+        parquet.write_table(table, out_file_name)
+    else:
+        feather.write_feather(table, out_file_name)
+
+
+# Función para extraer título y cuerpo de cada artículo (un ArticleRecord). Si
+# el link ya está en el índice 'seen', no se hace la petición.
+def _fetch_article(news_site_uid, host, link, seen = None, watermark = None):
+    url = _build_link(host, link)
+    if seen is not None and url in seen:
+        logger.info('Skipping already loaded article at {}'.format(url))
+        return None
+
     logger.info('Start fetching article at {}'.format(link))
 
     article = None
     # try y except para hacer el intento de ingresar al sitio de cada noticia.
     try:
-        # Intenta crear un objeto tipo ArticlePage 
-        article = news.ArticlePage(news_site_uid, _build_link(host, link))
-    # HTTPError por si el link lleva a un sitio inexistente.
+        # Intenta crear un objeto tipo ArticlePage y se queda sólo con su
+        # registro (título, cuerpo y url); la página y su árbol se liberan aquí.
+        article = news.ArticlePage(news_site_uid, url).record()
+    # RequestException por si el link lleva a un sitio inexistente (HTTPError),
+    # la conexión falla o se agota el tiempo de espera después de los
+    # reintentos de la política de descarga.
     # MaxRetryError evita intentos infinitos de acceder.
-    except (HTTPError, MaxRetryError) as e:
+    except (RequestException, MaxRetryError) as e:
         logger.warning('Error while fetching the article', exc_info = False)
+        if watermark is not None:
+            watermark.fail()
     # Si existe el artículo, pero no tiene cuerpo, se notifica y se desecha.
     if article and not article.text:
         logger.warning('Invalid article. There is no body')
@@ -121,7 +224,21 @@ if __name__ == '__main__':
     # El método add_argument sirve para especificar cómo debe ser el argumento que 
     # acompaña a la ejecución del programa.
     parser.add_argument('news_site', help = 'The news site to be scraped', type = str, choices = news_site_choices)
-
-    # Devuelve un objeto con el atributo news_site.
+    # Número de hilos para descargar artículos en paralelo (1 = en serie).
+    parser.add_argument('--workers', help = 'Number of articles fetched concurrently', type = int, default = 1)
+    # Reproduce la extracción sólo con las páginas guardadas en el caché HTTP.
+    parser.add_argument('--offline', help = 'Serve pages only from the HTTP cache', action = 'store_true')
+    # Descarga también los artículos que ya están en la base de datos.
+    parser.add_argument('--full', help = 'Fetch articles already loaded in the DB too', action = 'store_true')
+    # Formato del archivo de salida.
+    parser.add_argument('--format', help = 'Output file format', choices = FILE_FORMATS, default = 'csv')
+    # Retoma la extracción interrumpida a partir del diario del sitio.
+    parser.add_argument('--resume', help = 'Resume an interrupted crawl from its journal', action = 'store_true')
+
+    # Devuelve un objeto con los atributos news_site, workers, offline, full, format
+    # y resume.
     args = parser.parse_args()
-    _news_scraper(args.news_site)
\ No newline at end of file
+    if args.offline:
+        news.enable_offline_mode()
+    _news_scraper(args.news_site, args.workers, incremental = not args.full, file_format = args.format,
+                  resume = args.resume)
@@ -1,38 +1,221 @@
 # Page objects construidos para abstraer los objetos.
 
 #from unittest import result
+from collections import namedtuple
+import contextlib
+import gzip
+import io
+import os
+import sys
+import threading
+from urllib.parse import urlparse
+
 from common import config
+from fetch_policy import FetchPolicy
+from http_cache import HttpCache
+from page_parser import page_parser
 import requests
-import bs4
+from requests.adapters import HTTPAdapter
+
+# metrics.py vive en la raíz del repositorio.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics
+
+# Número de conexiones simultáneas por host si el sitio no define
+# 'max_connections_per_host' en config.yaml.
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 4
+
+# Una sesión (con su pool de conexiones keep-alive) por sitio de noticias y un
+# semáforo por host que limita las peticiones simultáneas.
+_sessions = {}
+_policies = {}
+_host_slots = {}
+_lock = threading.Lock()
+# Caché HTTP del proceso actual (ver _http_cache) y el pid que lo creó.
+_cache = None
+_cache_pid = None
+_offline = False
+
+# Registro compacto de un artículo: sólo los tres textos, en este orden (el de
+# las columnas de los archivos de Extract). Es lo que se guarda en memoria en
+# lugar de la página completa con su árbol .html.
+ArticleRecord = namedtuple('ArticleRecord', ('headline', 'text', 'url'))
+
+
+# Límite de conexiones simultáneas por host configurado para el sitio.
+def max_connections_per_host(news_site_uid):
+    site_config = config()['news_sites'][news_site_uid]
+    return site_config.get('max_connections_per_host', DEFAULT_MAX_CONNECTIONS_PER_HOST)
+
+
+# Devuelve la sesión compartida del sitio. La sesión reutiliza las conexiones
+# TCP entre peticiones, en lugar de abrir una nueva con cada requests.get.
+def _session(news_site_uid):
+    with _lock:
+        if news_site_uid not in _sessions:
+            pool_size = max_connections_per_host(news_site_uid)
+            adapter = HTTPAdapter(pool_connections = pool_size, pool_maxsize = pool_size)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.hooks['response'].append(_record_response)
+            _sessions[news_site_uid] = session
+
+        return _sessions[news_site_uid]
+
+
+# Política de descarga del sitio (timeouts, reintentos, ritmo y circuit
+# breaker). La sección 'fetch' de config.yaml da los valores generales y la
+# sección 'fetch' de cada sitio puede cambiar cualquiera de ellos.
+def _fetch_policy(news_site_uid):
+    session = _session(news_site_uid)
+    with _lock:
+        if news_site_uid not in _policies:
+            settings = dict(config().get('fetch', {}))
+            settings.update(config()['news_sites'][news_site_uid].get('fetch', {}))
+            _policies[news_site_uid] = FetchPolicy(news_site_uid, session, settings)
+
+        return _policies[news_site_uid]
+
+
+# Hook de requests: registra latencia, bytes y código de estado de cada
+# respuesta, por host. Con stream=True no se lee el cuerpo aquí (se leería
+# completo); se usa Content-Length si el servidor lo envía.
+def _record_response(response, *args, **kwargs):
+    host = urlparse(response.url).netloc
+    metrics.observe('etl_fetch_seconds', response.elapsed.total_seconds(), host = host)
+    if kwargs.get('stream'):
+        size = int(response.headers.get('Content-Length') or 0)
+    else:
+        size = len(response.content)
+    metrics.inc('etl_fetch_bytes', size, host = host)
+    metrics.inc('etl_fetch_responses', host = host, status = response.status_code)
+
+
+# Devuelve el semáforo del host de 'url'. Todas las páginas de un mismo host
+# comparten el semáforo, sin importar desde qué hilo se visiten.
+def _host_slot(news_site_uid, url):
+    host = urlparse(url).netloc
+    with _lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(max_connections_per_host(news_site_uid))
+
+        return _host_slots[host]
+
+
+# Cierra las sesiones y olvida las políticas y semáforos de los sitios para
+# que se vuelvan a crear con la configuración actual (después de recargar
+# config.yaml).
+def reset_sites():
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _policies.clear()
+        _host_slots.clear()
+
+
+# Activa el modo offline: las páginas sólo se leen del caché HTTP.
+def enable_offline_mode():
+    global _offline
+    _offline = True
+
+
+# Devuelve el caché HTTP configurado en la sección 'http_cache' de config.yaml,
+# o None si está desactivado. Se crea uno por proceso porque la conexión al
+# índice SQLite no puede compartirse entre procesos del pool de pipeline.py.
+def _http_cache():
+    global _cache, _cache_pid
+    cache_config = config().get('http_cache', {})
+    if not (cache_config.get('enabled') or _offline):
+        return None
+
+    with _lock:
+        if _cache is None or _cache_pid != os.getpid():
+            directory = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                     cache_config.get('directory', '.http_cache'))
+            max_bytes = cache_config.get('max_megabytes', 512) * 1024 * 1024
+            _cache = HttpCache(directory, max_bytes, offline = _offline or cache_config.get('offline', False))
+            _cache_pid = os.getpid()
+
+        return _cache
+
+
+# Abre 'url' (un sitemap o un feed RSS/Atom) como archivo binario para leerlo
+# por partes, con la misma política de descarga y límite por host que las
+# páginas. Si el caché HTTP está activado el cuerpo sale del caché; los
+# archivos .gz se descomprimen al vuelo.
+@contextlib.contextmanager
+def open_feed(news_site_uid, url):
+    compressed = urlparse(url).path.endswith('.gz')
+    fetcher = _fetch_policy(news_site_uid)
+    cache = _http_cache()
+
+    with _host_slot(news_site_uid, url):
+        if cache is not None and not compressed:
+            yield io.BytesIO(cache.get(fetcher, url).encode('utf-8'))
+            return
+
+        response = fetcher.get(url, stream = True)
+        try:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            yield gzip.GzipFile(fileobj = response.raw) if compressed else response.raw
+        finally:
+            response.close()
+
 
 # Clase padre que heredan la página principal y las páginas de cada noticia.
 class NewsPage:
+    # Consultas de 'queries' que usa cada tipo de página. Sólo esas partes del
+    # .html se construyen al parsear (ver page_parser).
+    _query_names = ()
+
     def __init__(self, news_site_uid, url):
         # Selecciona uno de los portales de noticias.
+        self._news_site_uid = news_site_uid
         self._config = config()['news_sites'][news_site_uid]
         # Selecciona los atributos para encontrar los links, título y cuerpo del sitio.
         self._queries = self._config['queries']
+        self._parser = page_parser(news_site_uid, self._query_names)
         self._html = None
         self._visit(url)
 
     # Devuelve la búsqueda en el archivo .html como cadena de texto.
     def _select(self, query_string):
         # El método select busca en el archivo .html la cadena 'query_string'.
-        return self._html.select(query_string)
+        return self._parser.select(self._html, query_string)
 
     def _visit(self, url):
-        # Hace la petición al sitio web 'url'.
-        response = requests.get(url)
+        # Hace la petición al sitio web 'url' con la sesión del sitio, sin
+        # rebasar el número de conexiones permitidas para su host.
+        with _host_slot(self._news_site_uid, url):
+            body = self._get(url)
+
+        # Guarda en el atributo _html el árbol del .html del sitio.
+        with metrics.timer('etl_parse_seconds', site = self._news_site_uid, step = 'tree'):
+            self._html = self._parser.parse(body)
+
+    # Devuelve el cuerpo de 'url' como texto, pasando por el caché HTTP si
+    # está activado. Las peticiones siguen la política de descarga del sitio.
+    def _get(self, url):
+        fetcher = _fetch_policy(self._news_site_uid)
+        cache = _http_cache()
+        if cache is not None:
+            return cache.get(fetcher, url)
+
+        response = fetcher.get(url)
         response.encoding = 'utf-8'
         # Protección en caso de que la página no permita el acceso (aquí se muestra
         # el error 403 de algunos sitios).
         response.raise_for_status()
 
-        # Guarda en el atributo _html el archivo .html en texto plano del sitio.
-        self._html = bs4.BeautifulSoup(response.text, 'html.parser')
+        return response.text
 
 
 class HomePage(NewsPage):
+    _query_names = ('homepage_article_links',)
+
     def __init__(self, news_site_uid, url):
         super().__init__(news_site_uid, url)
 
@@ -56,23 +239,34 @@ class HomePage(NewsPage):
 
 
 class ArticlePage(NewsPage):
+    _query_names = ('article_title', 'article_body')
+
     def __init__(self, news_site_uid, url):
         super().__init__(news_site_uid, url)
         self._url = url
 
     @property
     def headline(self):
-        result = self._select(self._queries['article_title'])
-        return result[0].text if len(result) else ''
+        with metrics.timer('etl_parse_seconds', site = self._news_site_uid, step = 'headline'):
+            result = self._select(self._queries['article_title'])
+            return result[0].text if len(result) else ''
 
     @property
     def text(self):
-        result = self._select(self._queries['article_body'])
-        # _select provee una lista. Devuelve el texto del primer elemento 
-        # (que debe ser el único) sólo si hay resultados en la lista; si no, 
-        # devuelve una cadena vacía.
-        return result[0].text if len(result) else ''
+        with metrics.timer('etl_parse_seconds', site = self._news_site_uid, step = 'text'):
+            result = self._select(self._queries['article_body'])
+            # _select provee una lista. Devuelve el texto del primer elemento 
+            # (que debe ser el único) sólo si hay resultados en la lista; si no, 
+            # devuelve una cadena vacía.
+            return result[0].text if len(result) else ''
 
     @property
     def url(self):
-        return self._url
\ No newline at end of file
+        return self._url
+
+    # Extrae título y cuerpo una sola vez y suelta el árbol .html, que ya no
+    # se vuelve a consultar.
+    def record(self):
+        article = ArticleRecord(self.headline, self.text, self._url)
+        self._html = None
+        return article
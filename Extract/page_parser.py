@@ -0,0 +1,85 @@
+# Parseo de páginas guiado por los selectores de config.yaml.
+#
+# Cada tipo de página sólo usa dos o tres selectores CSS, así que no hace falta
+# construir el árbol completo del .html. PageParser compila los selectores una
+# sola vez por sitio y, cuando todos empiezan con una clase ('.title-default a',
+# '.entry-content'), usa un SoupStrainer para que BeautifulSoup sólo construya
+# los elementos con esas clases (y su contenido). Como toda coincidencia de esos
+# selectores está dentro de un elemento con la clase inicial, el resultado de
+# select es el mismo que sobre el árbol completo.
+
+import re
+import threading
+
+import bs4
+import soupsieve
+
+from common import config
+
+# Selector cuya primera parte es una clase: '.clase', '.clase a', '.clase > p'.
+# Los combinadores de hermanos ('+', '~') pueden salir del elemento con la
+# clase, así que esos selectores no se filtran.
+_leading_class = re.compile(r'^\.(?P<class_name>[\w-]+)(?=$|[\s>])')
+
+_parsers = {}
+_lock = threading.Lock()
+
+
+# Backend de BeautifulSoup: html.parser, salvo que 'html_parser' en
+# config.yaml diga otro. lxml es más rápido, pero arma distinto el árbol del
+# html mal formado (por ejemplo, cierra un <p> al encontrar un <div> dentro),
+# así que algunos títulos y cuerpos cambian; por eso sólo se usa si se pide.
+def parser_backend():
+    return config().get('html_parser') or 'html.parser'
+
+
+# Devuelve el PageParser de un sitio para las consultas 'query_names' de su
+# sección 'queries'. Se construye una sola vez por proceso.
+def page_parser(news_site_uid, query_names):
+    key = (news_site_uid, tuple(query_names))
+    with _lock:
+        if key not in _parsers:
+            queries = config()['news_sites'][news_site_uid]['queries']
+            _parsers[key] = PageParser([queries[name] for name in query_names])
+
+        return _parsers[key]
+
+
+# Olvida los PageParser construidos, por ejemplo después de recargar
+# config.yaml.
+def reset_parsers():
+    with _lock:
+        _parsers.clear()
+
+
+class PageParser:
+    def __init__(self, selectors):
+        self._backend = parser_backend()
+        self._compiled = {selector: soupsieve.compile(selector) for selector in selectors}
+        self._strainer = _strainer(selectors)
+
+    def parse(self, body):
+        return bs4.BeautifulSoup(body, self._backend, parse_only = self._strainer)
+
+    # Igual que html.select(selector), pero con el selector ya compilado.
+    def select(self, html, selector):
+        compiled = self._compiled.get(selector)
+        if compiled is None:
+            return html.select(selector)
+
+        return compiled.select(html)
+
+
+# SoupStrainer que sólo conserva los elementos con la clase inicial de cada
+# selector, o None (árbol completo) si algún selector no se puede filtrar así.
+def _strainer(selectors):
+    class_names = []
+    for selector in selectors:
+        for part in selector.split(','):
+            part = part.strip()
+            match = _leading_class.match(part)
+            if not match or '+' in part or '~' in part:
+                return None
+            class_names.append(match.group('class_name'))
+
+    return bs4.SoupStrainer(attrs = {'class': class_names})
@@ -0,0 +1,52 @@
+# Índice de artículos ya cargados en la base de datos.
+#
+# newspaper_recipe genera la uid de cada artículo como md5(url), y esa uid es
+# la llave primaria de la tabla 'articles'. Con las uids de la tabla se puede
+# saber, antes de descargar una nota, si ya se procesó en una corrida anterior.
+
+import hashlib
+import logging
+import os
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+
+# Misma uid que _uids_generator en Transform/newspaper_recipe.py, pero como
+# bytes (16 bytes por artículo en lugar de una cadena hexadecimal de 32).
+def _uid(url):
+    return hashlib.md5(url.encode()).digest()
+
+
+class SeenIndex:
+    def __init__(self, uids = ()):
+        self._uids = set(uids)
+
+    # Crea el índice con las uids de la tabla 'articles'. Si la base de datos
+    # o la tabla todavía no existen, el índice queda vacío.
+    @classmethod
+    def from_database(cls, db_path):
+        if not os.path.exists(db_path):
+            logger.info('No articles database at {}, every link will be fetched'.format(db_path))
+            return cls()
+
+        connection = sqlite3.connect(db_path)
+        try:
+            rows = connection.execute('SELECT id FROM articles')
+            index = cls(bytes.fromhex(uid) for (uid,) in rows)
+        except sqlite3.OperationalError:
+            index = cls()
+        finally:
+            connection.close()
+
+        logger.info('{} articles already loaded in {}'.format(len(index), db_path))
+        return index
+
+    def __contains__(self, url):
+        return _uid(url) in self._uids
+
+    def __len__(self):
+        return len(self._uids)
+
+    def add(self, url):
+        self._uids.add(_uid(url))
@@ -1,5 +1,28 @@
-from sqlalchemy import Column, String, Integer
-from base import Base
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, LargeBinary, String, event, inspect
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import relationship
+
+from base import Base, Session
+import bodies
+import rollups
+import search
+
+
+# Cuerpo de un artículo, comprimido y guardado una sola vez por contenido
+# (ver bodies.py).
+class ArticleBody(Base):
+    __tablename__ = 'article_bodies'
+
+    # sha256 del texto.
+    hash = Column(LargeBinary, primary_key = True)
+    data = Column(LargeBinary, nullable = False)
+    # Largo del texto sin comprimir, en caracteres.
+    length = Column(Integer)
+
+    @property
+    def text(self):
+        return bodies.decompress(self.data)
+
 
 class Article(Base):
     __tablename__ = 'articles'
@@ -7,16 +30,24 @@ class Article(Base):
     # Se declara que las variables son columnas y el tipo de cada una,
     # La UID tiene el constraint PK.
     id = Column(String, primary_key = True)
-    text = Column(String)
-    host = Column(String)
+    # El cuerpo vive en 'article_bodies'; aquí sólo su hash.
+    text_hash = Column(LargeBinary, ForeignKey('article_bodies.hash'), index = True)
+    # host y newspaper_uid tienen índice, porque los análisis filtran y
+    # agrupan por periódico.
+    host = Column(String, index = True)
     headline = Column(String)
-    newspaper_uid = Column(String)
+    newspaper_uid = Column(String, index = True)
     text_tokens = Column(Integer)
     headline_tokens = Column(Integer)
     # La URL tiene el constraint unique.
     url = Column(String, unique = True)
+    # Fecha y hora (UTC) de la primera extracción del artículo.
+    crawled_at = Column(DateTime, index = True)
+
+    body = relationship(ArticleBody, viewonly = True)
 
-    def __init__(self, uid, headline, text, url, newspaper_uid, host, headline_tokens, text_tokens):
+    def __init__(self, uid, headline, text, url, newspaper_uid, host, headline_tokens, text_tokens,
+                 crawled_at = None):
         self.id = uid
         self.text = text
         self.host = host
@@ -25,3 +56,74 @@ class Article(Base):
         self.text_tokens = text_tokens
         self.headline_tokens = headline_tokens
         self.url = url
+        self.crawled_at = crawled_at
+
+    # El texto se descomprime la primera vez que se lee.
+    @property
+    def text(self):
+        if getattr(self, '_text', None) is None and self.body is not None:
+            self._text = self.body.text
+
+        return getattr(self, '_text', None)
+
+    # Al asignar el texto sólo cambia text_hash; el cuerpo se guarda en
+    # 'article_bodies' al hacer flush (ver _store_bodies).
+    @text.setter
+    def text(self, text):
+        self._text = text
+        self._text_pending = text is not None
+        self.text_hash = bodies.body_hash(text) if text is not None else None
+
+
+# Antes de escribir los artículos nuevos o modificados con la sesión, guarda
+# sus cuerpos (los que ya existen no se duplican).
+@event.listens_for(Session, 'before_flush')
+def _store_bodies(session, flush_context, instances):
+    pending = [article for article in session.new | session.dirty
+               if isinstance(article, Article) and getattr(article, '_text_pending', False)]
+    if not pending:
+        return
+
+    rows = {bodies.body_hash(article._text): article._text for article in pending}
+    statement = insert(ArticleBody.__table__).on_conflict_do_nothing(index_elements = ['hash'])
+    session.execute(statement, [{'hash': key, 'data': bodies.compress(text), 'length': len(text)}
+                                for key, text in rows.items()])
+    for article in pending:
+        article._text_pending = False
+
+
+# Las escrituras de artículos con la sesión mantienen lo mismo que test.load:
+# antes del flush se leen los totales de resumen, el estado del índice de
+# búsqueda y los cuerpos actuales de las urls afectadas, y después del flush
+# se aplican las diferencias (ver rollups.py y search.py) y se borran los
+# cuerpos que dejaron de usarse.
+@event.listens_for(Session, 'before_flush')
+def _read_summaries(session, flush_context, instances):
+    urls = set()
+    for article in session.new | session.dirty | session.deleted:
+        if isinstance(article, Article):
+            urls.add(article.url)
+            # Si cambió la url, también la anterior.
+            urls.update(inspect(article).attrs.url.history.deleted or ())
+    urls.discard(None)
+    if not urls:
+        return
+
+    connection = session.connection()
+    rollups.migrate(connection)
+    search.ensure_index(connection)
+    session.info['article_summaries'] = (urls, rollups.totals(connection, urls), search.state(connection, urls),
+                                         bodies.current_hashes(connection, urls))
+
+
+@event.listens_for(Session, 'after_flush')
+def _apply_summaries(session, flush_context):
+    summaries = session.info.pop('article_summaries', None)
+    if summaries is None:
+        return
+
+    urls, totals, indexed, hashes = summaries
+    connection = session.connection()
+    rollups.apply(connection, totals, rollups.totals(connection, urls))
+    search.apply(connection, indexed, search.state(connection, urls))
+    bodies.prune(connection, hashes)
@@ -1,11 +1,39 @@
-from sqlalchemy import create_engine
+import os
+import sqlite3
+
+from sqlalchemy import create_engine, event
 # La clase declarative permite tener acceso a funcionalidades de ORM (Object Relational Mapper),
 # que permite trabajar con objetos de Python en lugar de queries de SQL directamente.
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+# Indica que vamos a usar sqlite. La base de datos vive en la carpeta Load sin
+# importar desde dónde se ejecute el proceso, salvo que la variable de entorno
+# NEWSPAPER_DB indique otra ruta (por ejemplo, en los benchmarks).
+def db_path():
+    return os.environ.get('NEWSPAPER_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'newspaper.db'))
+
+
+# La ruta se lee al abrir cada conexión, así que un proceso puede cambiar
+# NEWSPAPER_DB y llamar a Engine.dispose() para pasar a otra base de datos (lo
+# hace el benchmark con una temporal). check_same_thread y QueuePool son lo
+# que SQLAlchemy usa con una url de archivo.
+Engine = create_engine('sqlite://', creator = lambda: sqlite3.connect(db_path(), check_same_thread = False),
+                       poolclass = QueuePool)
+
 
-# Indica que vamos a usar sqlite.
-Engine = create_engine('sqlite:///newspaper.db')
+# Ajustes de SQLite para cargas grandes, aplicados a cada conexión nueva:
+# WAL permite leer mientras se escribe y, con synchronous = NORMAL, sólo se
+# sincroniza el disco en los checkpoints y no en cada commit.
+@event.listens_for(Engine, 'connect')
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode = WAL')
+    cursor.execute('PRAGMA synchronous = NORMAL')
+    cursor.execute('PRAGMA temp_store = MEMORY')
+    cursor.execute('PRAGMA cache_size = -65536')
+    cursor.close()
 
 Session = sessionmaker(bind = Engine)
 
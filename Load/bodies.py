@@ -0,0 +1,125 @@
+# Almacenamiento de los cuerpos de los artículos por contenido.
+#
+# El texto de cada artículo no se guarda en 'articles' sino en la tabla
+# 'article_bodies', comprimido con zlib y con el sha256 del texto como llave.
+# 'articles.text_hash' apunta a esa fila, así que las notas con el mismo cuerpo
+# (las de agencias, o la misma nota con varias urls) comparten una sola copia.
+# El modelo Article descomprime el texto al leerlo (Article.text); search.py y
+# test.py usan directamente las funciones de este módulo.
+
+import hashlib
+import logging
+import zlib
+
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_LEVEL = 6
+# Máximo de variables por consulta con 'IN (...)'.
+_BATCH = 500
+
+
+def body_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+
+def compress(text):
+    return zlib.compress(text.encode('utf-8'), COMPRESSION_LEVEL)
+
+
+def decompress(data):
+    if data is None:
+        return None
+
+    return zlib.decompress(data).decode('utf-8')
+
+
+# Guarda los cuerpos que todavía no están en 'article_bodies' y devuelve el
+# hash de cada texto, en el mismo orden. Sólo se comprimen los nuevos.
+def store(connection, texts):
+    hashes = [body_hash(text) for text in texts]
+    unique = dict(zip(hashes, texts))
+
+    missing = set(unique)
+    keys = list(unique)
+    for i in range(0, len(keys), _BATCH):
+        batch = keys[i:i + _BATCH]
+        missing.difference_update(row[0] for row in connection.exec_driver_sql(
+            'SELECT hash FROM article_bodies WHERE hash IN ({})'.format(','.join('?' * len(batch))), tuple(batch)))
+
+    if missing:
+        connection.exec_driver_sql('INSERT OR IGNORE INTO article_bodies (hash, data, length) VALUES (?, ?, ?)',
+                                   [(key, compress(unique[key]), len(unique[key])) for key in missing])
+
+    return hashes
+
+
+# Hash del cuerpo actual de los artículos con estas urls.
+def current_hashes(connection, urls):
+    urls = list(urls)
+    hashes = set()
+    for i in range(0, len(urls), _BATCH):
+        batch = urls[i:i + _BATCH]
+        hashes.update(row[0] for row in connection.exec_driver_sql(
+            'SELECT text_hash FROM articles WHERE url IN ({}) AND text_hash IS NOT NULL'.format(
+                ','.join('?' * len(batch))), tuple(batch)))
+
+    return hashes
+
+
+# Texto de los cuerpos de 'hashes', por hash.
+def texts(connection, hashes):
+    hashes = list(hashes)
+    result = {}
+    for i in range(0, len(hashes), _BATCH):
+        batch = hashes[i:i + _BATCH]
+        for key, data in connection.exec_driver_sql(
+                'SELECT hash, data FROM article_bodies WHERE hash IN ({})'.format(','.join('?' * len(batch))),
+                tuple(batch)):
+            result[key] = decompress(data)
+
+    return result
+
+
+# Borra los cuerpos de 'hashes' que ya no usa ningún artículo (por ejemplo,
+# después de que un ON CONFLICT DO UPDATE cambió el texto de una nota).
+def prune(connection, hashes):
+    hashes = list(hashes)
+    for i in range(0, len(hashes), _BATCH):
+        batch = hashes[i:i + _BATCH]
+        connection.exec_driver_sql(
+            '''DELETE FROM article_bodies WHERE hash IN ({})
+               AND NOT EXISTS (SELECT 1 FROM articles WHERE articles.text_hash = article_bodies.hash)'''.format(
+                ','.join('?' * len(batch))), tuple(batch))
+
+
+# Migra una tabla 'articles' con el cuerpo en la columna 'text' (la de antes
+# de este módulo): agrega text_hash, pasa los cuerpos a 'article_bodies' por
+# lotes y quita la columna 'text'. Si la versión de SQLite no permite quitar
+# columnas (DROP COLUMN llegó en la 3.35), la columna queda vacía.
+def migrate(connection):
+    columns = {row[1] for row in connection.exec_driver_sql('PRAGMA table_info(articles)')}
+    if 'text' not in columns:
+        return
+    if 'text_hash' not in columns:
+        connection.exec_driver_sql('ALTER TABLE articles ADD COLUMN text_hash BLOB REFERENCES article_bodies (hash)')
+    elif connection.exec_driver_sql('SELECT 1 FROM articles WHERE text IS NOT NULL LIMIT 1').fetchone() is None:
+        return
+
+    logger.info('Moving article bodies into article_bodies...')
+    while True:
+        rows = connection.exec_driver_sql(
+            'SELECT rowid, text FROM articles WHERE text_hash IS NULL AND text IS NOT NULL LIMIT ?',
+            (_BATCH,)).fetchall()
+        if not rows:
+            break
+        hashes = store(connection, [text for rowid, text in rows])
+        connection.exec_driver_sql('UPDATE articles SET text_hash = ? WHERE rowid = ?',
+                                   [(text_hash, rowid) for text_hash, (rowid, text) in zip(hashes, rows)])
+
+    try:
+        connection.exec_driver_sql('ALTER TABLE articles DROP COLUMN text')
+    except OperationalError:
+        connection.exec_driver_sql('UPDATE articles SET text = NULL')
+    logger.info('Article bodies migrated. Run VACUUM on the database to reclaim the freed space')
@@ -0,0 +1,143 @@
+# Tablas de resumen de la tabla 'articles'.
+#
+# 'article_stats_daily' guarda, por día de extracción (UTC), newspaper_uid y
+# host, el número de artículos y la suma de headline_tokens y text_tokens. El
+# loader la actualiza en cada lote: lee los totales de las urls del lote antes
+# y después del INSERT ... ON CONFLICT y suma la diferencia, así que las notas
+# nuevas, las actualizadas y las ignoradas cuentan bien sin volver a recorrer
+# la tabla. stats() responde las preguntas de los tableros (artículos por sitio
+# por día, promedio de text_tokens por periódico) a partir del resumen.
+#
+# Uso: python rollups.py --by newspaper_uid day --since 2026-10-01 --site milenio
+
+import argparse
+
+# Grupos posibles en stats().
+GROUPS = ('day', 'newspaper_uid', 'host')
+# Día de los artículos cargados antes de que existiera 'crawled_at'.
+UNKNOWN_DAY = 'unknown'
+# Máximo de variables por consulta con 'IN (...)'.
+_BATCH = 500
+
+_totals_sql = '''SELECT COALESCE(date(crawled_at), '{}'), COALESCE(newspaper_uid, ''), COALESCE(host, ''),
+                        COUNT(*), COALESCE(SUM(headline_tokens), 0), COALESCE(SUM(text_tokens), 0)
+                 FROM articles {{}} GROUP BY 1, 2, 3'''.format(UNKNOWN_DAY)
+
+
+# Agrega 'crawled_at' a una tabla 'articles' anterior y crea la tabla de
+# resumen; si la tabla es nueva, la llena con los artículos que ya existen.
+def migrate(connection):
+    columns = {row[1] for row in connection.exec_driver_sql('PRAGMA table_info(articles)')}
+    if 'crawled_at' not in columns:
+        connection.exec_driver_sql('ALTER TABLE articles ADD COLUMN crawled_at DATETIME')
+
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'article_stats_daily'").fetchone()
+    if exists:
+        return
+
+    connection.exec_driver_sql('''CREATE TABLE article_stats_daily (
+                                      day TEXT NOT NULL,
+                                      newspaper_uid TEXT NOT NULL,
+                                      host TEXT NOT NULL,
+                                      articles INTEGER NOT NULL,
+                                      headline_tokens INTEGER NOT NULL,
+                                      text_tokens INTEGER NOT NULL,
+                                      PRIMARY KEY (day, newspaper_uid, host))''')
+    connection.exec_driver_sql('INSERT INTO article_stats_daily ' + _totals_sql.format(''))
+
+
+# Totales actuales de los artículos con estas urls, por (día, periódico, host).
+def totals(connection, urls):
+    urls = list(urls)
+    result = {}
+    for i in range(0, len(urls), _BATCH):
+        batch = urls[i:i + _BATCH]
+        where = 'WHERE url IN ({})'.format(','.join('?' * len(batch)))
+        for day, newspaper_uid, host, count, headline_tokens, text_tokens in connection.exec_driver_sql(
+                _totals_sql.format(where), tuple(batch)):
+            key = (day, newspaper_uid, host)
+            previous = result.get(key, (0, 0, 0))
+            result[key] = (previous[0] + count, previous[1] + headline_tokens, previous[2] + text_tokens)
+
+    return result
+
+
+# Suma al resumen la diferencia entre los totales de después y los de antes
+# de un lote, y borra los grupos que se quedan sin artículos.
+def apply(connection, before, after):
+    deltas = []
+    for key in set(before) | set(after):
+        old = before.get(key, (0, 0, 0))
+        new = after.get(key, (0, 0, 0))
+        delta = tuple(n - o for n, o in zip(new, old))
+        if any(delta):
+            deltas.append(key + delta)
+
+    if not deltas:
+        return
+
+    connection.exec_driver_sql('''INSERT INTO article_stats_daily VALUES (?, ?, ?, ?, ?, ?)
+                                  ON CONFLICT (day, newspaper_uid, host) DO UPDATE SET
+                                      articles = articles + excluded.articles,
+                                      headline_tokens = headline_tokens + excluded.headline_tokens,
+                                      text_tokens = text_tokens + excluded.text_tokens''', deltas)
+    connection.exec_driver_sql('DELETE FROM article_stats_daily WHERE articles <= 0')
+
+
+# Lee el resumen agrupado por las columnas de 'by' (de GROUPS). since/until
+# ('AAAA-MM-DD', inclusivos) y newspaper_uid filtran los días y el periódico.
+# Devuelve diccionarios con los grupos, articles, headline_tokens,
+# text_tokens y los promedios por artículo.
+def stats(connection, by = ('newspaper_uid',), since = None, until = None, newspaper_uid = None):
+    by = list(by)
+    unknown = [group for group in by if group not in GROUPS]
+    if unknown:
+        raise ValueError('Unknown groups {}, expected some of {}'.format(unknown, GROUPS))
+
+    conditions, params = [], []
+    if since:
+        conditions.append("day >= ? AND day != '{}'".format(UNKNOWN_DAY))
+        params.append(since)
+    if until:
+        conditions.append("day <= ? AND day != '{}'".format(UNKNOWN_DAY))
+        params.append(until)
+    if newspaper_uid:
+        conditions.append('newspaper_uid = ?')
+        params.append(newspaper_uid)
+
+    sql = 'SELECT {}SUM(articles), SUM(headline_tokens), SUM(text_tokens) FROM article_stats_daily'.format(
+        ''.join('{}, '.format(group) for group in by))
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    if by:
+        sql += ' GROUP BY {0} ORDER BY {0}'.format(', '.join(by))
+
+    results = []
+    for row in connection.exec_driver_sql(sql, tuple(params)):
+        result = dict(zip(by + ['articles', 'headline_tokens', 'text_tokens'], row))
+        if not result['articles']:
+            continue
+        result['avg_headline_tokens'] = result['headline_tokens'] / result['articles']
+        result['avg_text_tokens'] = result['text_tokens'] / result['articles']
+        results.append(result)
+
+    return results
+
+
+if __name__ == '__main__':
+    from base import Engine
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--by', help = 'Columns to group by', nargs = '*', choices = GROUPS,
+                        default = ['newspaper_uid'])
+    parser.add_argument('--since', help = 'First day (YYYY-MM-DD)', type = str)
+    parser.add_argument('--until', help = 'Last day (YYYY-MM-DD)', type = str)
+    parser.add_argument('--site', help = 'Only this newspaper_uid', type = str)
+    args = parser.parse_args()
+
+    with Engine.connect() as connection:
+        for result in stats(connection, args.by, args.since, args.until, args.site):
+            groups = '  '.join(str(result[group]) for group in args.by)
+            print('{}  {:>8} articles  {:>10.1f} avg text tokens'.format(groups, result['articles'],
+                                                                        result['avg_text_tokens']))
@@ -0,0 +1,145 @@
+# Búsqueda de texto completo sobre la tabla 'articles'.
+#
+# La tabla virtual FTS5 'articles_fts' indexa headline y text de cada artículo
+# (con el mismo rowid que en 'articles') ya normalizados: en minúsculas y sin
+# las palabras clave vacías de nltk en español, la misma lista que usa
+# newspaper_recipe para contar tokens (ver stop_words.py). El tokenizador
+# unicode61 además ignora los acentos, así que 'elección' y 'eleccion'
+# encuentran lo mismo. La tabla no guarda el contenido (content = ''), sólo el
+# índice: los cuerpos ya están comprimidos en 'article_bodies' y search() no
+# lee las columnas de vuelta. Por eso, para quitar un artículo del índice hay
+# que pasar sus valores anteriores (el comando 'delete' de FTS5).
+#
+# El loader lee state() de las urls de cada lote antes y después del INSERT
+# ... ON CONFLICT y apply() reindexa sólo los artículos cuyo headline o
+# text_hash cambió, igual que rollups.py con los totales. search() devuelve los
+# resultados ordenados por bm25, con más peso en el título.
+#
+# Uso: python search.py "reforma electoral" --limit 10 --site milenio
+
+import argparse
+import os
+import re
+import sys
+
+import bodies
+
+# stop_words.py vive en la raíz del repositorio.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stop_words import stop_words
+
+# Peso de headline y text en el orden de bm25.
+HEADLINE_WEIGHT = 2.0
+TEXT_WEIGHT = 1.0
+# Máximo de variables por consulta con 'IN (...)'.
+_BATCH = 500
+
+_words = re.compile(r'\w+')
+
+
+# Texto en minúsculas sin palabras clave vacías, como se guarda en el índice.
+def normalize(text):
+    words = stop_words()
+    return ' '.join(word for word in _words.findall((text or '').lower()) if word not in words)
+
+
+# Crea la tabla FTS5 si no existe y la llena con los artículos que ya estén
+# en 'articles'. Una tabla de una versión anterior, que guardaba una copia del
+# contenido, se reemplaza.
+def ensure_index(connection):
+    sql = connection.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'articles_fts'").fetchone()
+    if sql is not None and "content = ''" in sql[0]:
+        return
+    if sql is not None:
+        connection.exec_driver_sql('DROP TABLE articles_fts')
+
+    connection.exec_driver_sql("""CREATE VIRTUAL TABLE articles_fts USING fts5(
+                                      headline, text, content = '',
+                                      tokenize = 'unicode61 remove_diacritics 2')""")
+    last = 0
+    while True:
+        rows = connection.exec_driver_sql(
+            'SELECT rowid, headline, text_hash FROM articles WHERE rowid > ? ORDER BY rowid LIMIT ?',
+            (last, _BATCH)).fetchall()
+        if not rows:
+            break
+        _insert(connection, 'INSERT INTO articles_fts (rowid, headline, text) VALUES (?, ?, ?)', rows)
+        last = rows[-1][0]
+
+
+# headline y text_hash actuales de los artículos con estas urls, por rowid.
+def state(connection, urls):
+    urls = list(urls)
+    result = {}
+    for i in range(0, len(urls), _BATCH):
+        batch = urls[i:i + _BATCH]
+        for rowid, headline, text_hash in connection.exec_driver_sql(
+                'SELECT rowid, headline, text_hash FROM articles WHERE url IN ({})'.format(
+                    ','.join('?' * len(batch))), tuple(batch)):
+            result[rowid] = (headline, text_hash)
+
+    return result
+
+
+# Reindexa los artículos cuyo headline o text_hash es distinto en 'after' que
+# en 'before' (de state()) y quita los que ya no están. Se llama antes de
+# borrar los cuerpos que dejaron de usarse, porque quitar la entrada anterior
+# necesita su texto.
+def apply(connection, before, after):
+    changed = [rowid for rowid, values in after.items() if before.get(rowid) != values]
+    removed = [rowid for rowid in before if rowid not in after]
+    _insert(connection, "INSERT INTO articles_fts (articles_fts, rowid, headline, text) VALUES ('delete', ?, ?, ?)",
+            [(rowid,) + before[rowid] for rowid in changed + removed if rowid in before])
+    _insert(connection, 'INSERT INTO articles_fts (rowid, headline, text) VALUES (?, ?, ?)',
+            [(rowid,) + after[rowid] for rowid in changed])
+
+
+# Ejecuta 'sql' con (rowid, headline, texto), ya normalizados, de cada fila
+# (rowid, headline, text_hash). Los cuerpos se leen de 'article_bodies'.
+def _insert(connection, sql, rows):
+    if not rows:
+        return
+
+    texts = bodies.texts(connection, {text_hash for rowid, headline, text_hash in rows if text_hash is not None})
+    connection.exec_driver_sql(sql, [(rowid, normalize(headline), normalize(texts.get(text_hash)))
+                                     for rowid, headline, text_hash in rows])
+
+
+# Busca 'query' (todas sus palabras, sin contar las vacías) y devuelve hasta
+# 'limit' diccionarios con uid, headline, url, newspaper_uid y score (menor es
+# mejor, como bm25). Con newspaper_uid sólo busca en ese periódico.
+def search(connection, query, limit = 20, newspaper_uid = None):
+    terms = normalize(query).split()
+    if not terms:
+        return []
+
+    # Cada palabra va entre comillas para que no se interprete como
+    # operador de FTS5.
+    match = ' '.join('"{}"'.format(term) for term in terms)
+    sql = '''SELECT a.id, a.headline, a.url, a.newspaper_uid, bm25(articles_fts, ?, ?) AS score
+             FROM articles_fts JOIN articles a ON a.rowid = articles_fts.rowid
+             WHERE articles_fts MATCH ?'''
+    params = [HEADLINE_WEIGHT, TEXT_WEIGHT, match]
+    if newspaper_uid:
+        sql += ' AND a.newspaper_uid = ?'
+        params.append(newspaper_uid)
+    sql += ' ORDER BY score LIMIT ?'
+    params.append(limit)
+
+    columns = ('uid', 'headline', 'url', 'newspaper_uid', 'score')
+    return [dict(zip(columns, row)) for row in connection.exec_driver_sql(sql, tuple(params))]
+
+
+if __name__ == '__main__':
+    from base import Engine
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('query', help = 'Words to search for', type = str)
+    parser.add_argument('--limit', help = 'Maximum number of results', type = int, default = 20)
+    parser.add_argument('--site', help = 'Only search this newspaper_uid', type = str)
+    args = parser.parse_args()
+
+    with Engine.connect() as connection:
+        for result in search(connection, args.query, args.limit, args.site):
+            print('{score:8.3f}  [{newspaper_uid}] {headline}\n          {url}'.format(**result))
@@ -1,39 +1,188 @@
 import argparse
+import datetime
 import logging
+import os
+import re
+import sys
+import time
 logging.basicConfig(level = logging.INFO)
 
 import pandas as pd
+from sqlalchemy.dialects.sqlite import insert
 
 from article import Article
-from base import Base, Engine, Session
+from base import Base, Engine
+import bodies
+import rollups
+import search
+
+# metrics.py vive en la raíz del repositorio.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics
 
 logger = logging.getLogger(__name__)
 
-def main(filename):
+# Filas por cada INSERT (executemany) y lotes por cada commit.
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_COMMIT_EVERY = 10
+# Qué hacer con un artículo cuya url ya está en la tabla: 'update' lo
+# reemplaza con los datos nuevos e 'ignore' conserva el que ya estaba.
+ON_CONFLICT_CHOICES = ('update', 'ignore')
+
+# Columnas de la tabla 'articles' y la columna del DataFrame de la que salen.
+# text_hash es el hash de 'text'; el texto comprimido va a 'article_bodies'.
+_columns = {
+    'id': 'uid',
+    'text_hash': 'text',
+    'host': 'host',
+    'headline': 'headline',
+    'newspaper_uid': 'newspaper_uid',
+    'text_tokens': 'text_tokens',
+    'headline_tokens': 'headline_tokens',
+    'url': 'url',
+}
+
+# Fecha en el nombre de los archivos de Transform: clean_sitio_dd-mm-aaaa_articles.csv.
+_file_date = re.compile(r'_(\d{2}-\d{2}-\d{4})_articles\.')
+
+
+def main(filename, batch_size = DEFAULT_BATCH_SIZE, commit_every = DEFAULT_COMMIT_EVERY, on_conflict = 'update'):
+    articles = _read_data(filename)
+    load(articles, batch_size, commit_every, on_conflict, _crawl_date(filename))
+
+
+# Fecha de extracción según el nombre del archivo, o None si no la trae. Extract
+# pone en el nombre la fecha local; se guarda la medianoche local en UTC (sin
+# zona horaria), como la hora de carga que usa load() por defecto.
+def _crawl_date(filename):
+    match = _file_date.search(os.path.basename(filename))
+    if not match:
+        return None
+
+    local_midnight = datetime.datetime.strptime(match.group(1), '%d-%m-%Y').astimezone()
+    return local_midnight.astimezone(datetime.timezone.utc).replace(tzinfo = None)
+
+
+# Lee el archivo limpio en .csv, .parquet o .feather (este último con memory
+# map, sin copiarlo completo a memoria).
+def _read_data(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.parquet':
+        return pd.read_parquet(filename)
+    if extension == '.feather':
+        from pyarrow import feather
+        return feather.read_table(filename, memory_map = True).to_pandas()
+
+    return pd.read_csv(filename)
+
+
+# Carga en la base de datos un DataFrame ya limpio. Acepta la 'uid' como
+# columna (al leer el .csv) o como índice (al recibirlo de newspaper_recipe).
+# Las filas se insertan en lotes de batch_size con un solo executemany, y se
+# hace commit cada commit_every lotes. Como los artículos repetidos se
+# resuelven con ON CONFLICT(url), la carga se puede repetir sin errores. Los
+# cuerpos de cada lote se guardan antes en 'article_bodies' (ver bodies.py) y,
+# al actualizar, se borran los que dejaron de usarse. Las notas nuevas se
+# marcan con crawled_at (por defecto, la hora UTC de la carga) y la tabla de
+# resumen de rollups.py se actualiza con cada lote.
+def load(articles, batch_size = DEFAULT_BATCH_SIZE, commit_every = DEFAULT_COMMIT_EVERY, on_conflict = 'update',
+         crawled_at = None):
+    _create_schema()
+    if 'uid' not in articles.columns:
+        articles = articles.reset_index()
+
+    statement = _insert_statement(on_conflict)
+    rows = _rows(articles, crawled_at or datetime.datetime.utcnow())
+    texts = articles['text'].tolist()
+    connection = Engine.connect()
+    transaction = connection.begin()
+    try:
+        search.ensure_index(connection)
+        for batch_number, start in enumerate(range(0, len(rows), batch_size), start = 1):
+            batch = rows[start:start + batch_size]
+            logger.info('Loading {} articles into DB ({}/{})...'.format(len(batch), start + len(batch), len(rows)))
+            start_time = time.perf_counter()
+            stored = bodies.store(connection, texts[start:start + batch_size])
+            urls = [row['url'] for row in batch]
+            # Cuerpos de las notas que este lote puede reemplazar, totales de
+            # resumen y estado del índice de búsqueda de esas urls antes del
+            # INSERT.
+            replaced = bodies.current_hashes(connection, urls) if on_conflict == 'update' else ()
+            before = rollups.totals(connection, urls)
+            indexed = search.state(connection, urls)
+            connection.execute(statement, batch)
+            rollups.apply(connection, before, rollups.totals(connection, urls))
+            # El índice de búsqueda se actualiza en la misma transacción, sólo
+            # con las notas que cambiaron.
+            search.apply(connection, indexed, search.state(connection, urls))
+            # Con 'ignore', los cuerpos de las notas que ya existían no quedan
+            # referenciados; prune sólo borra los que nadie usa.
+            bodies.prune(connection, set(replaced) | set(stored))
+            metrics.inc('etl_load_seconds', time.perf_counter() - start_time)
+            metrics.inc('etl_load_rows', len(batch))
+
+            if batch_number % commit_every == 0:
+                transaction.commit()
+                transaction = connection.begin()
+
+        transaction.commit()
+    except Exception:
+        transaction.rollback()
+        raise
+    finally:
+        connection.close()
+
+
+# Crea las tablas que falten y los índices de 'articles'. create_all no agrega
+# índices a una tabla que ya existía, así que se crean aparte, después de
+# migrar una tabla 'articles' que todavía guarde el texto en sí.
+def _create_schema():
     Base.metadata.create_all(Engine)
-    session = Session()
-    articles = pd.read_csv(filename)
+    with Engine.begin() as connection:
+        bodies.migrate(connection)
+        rollups.migrate(connection)
+    for index in Article.__table__.indexes:
+        index.create(Engine, checkfirst = True)
+
+
+# INSERT ... ON CONFLICT(url) DO UPDATE / DO NOTHING sobre la tabla 'articles'.
+# Al actualizar se conserva el crawled_at de la primera extracción.
+def _insert_statement(on_conflict):
+    statement = insert(Article.__table__)
+    if on_conflict == 'ignore':
+        return statement.on_conflict_do_nothing(index_elements = ['url'])
+
+    updated = {column: statement.excluded[column] for column in _columns if column not in ('id', 'url')}
+    return statement.on_conflict_do_update(index_elements = ['url'], set_ = updated)
+
 
-    for index, row in articles.iterrows():
-        logger.info('Loading article uid {} into DB...'.format(row['uid']))
-        article = Article(row['uid'], 
-                    row['headline'], 
-                    row['text'], row['url'], 
-                    row['newspaper_uid'], 
-                    row['host'], 
-                    row['headline_tokens'], 
-                    row['text_tokens'])
+# Convierte el DataFrame en una lista de diccionarios con los nombres de las
+# columnas de la tabla. Los conteos se pasan a int de Python, porque sqlite3
+# no acepta los enteros de numpy, y el texto se cambia por su hash. Todas las
+# filas llevan el mismo crawled_at.
+def _rows(articles, crawled_at):
+    records = articles[list(_columns.values())].to_dict('records')
+    return [dict({column: _value(column, record[source]) for column, source in _columns.items()},
+                 crawled_at = crawled_at)
+            for record in records]
 
-        session.add(article)
 
-    session.commit()
-    session.close()
+def _value(column, value):
+    if column.endswith('_tokens'):
+        return int(value)
+    if column == 'text_hash':
+        return bodies.body_hash(value)
 
+    return value
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('filename', help = 'File to be uploaded into DB.', type = str)
+    parser.add_argument('--batch-size', help = 'Rows per INSERT', type = int, default = DEFAULT_BATCH_SIZE)
+    parser.add_argument('--commit-every', help = 'Batches per commit', type = int, default = DEFAULT_COMMIT_EVERY)
+    parser.add_argument('--on-conflict', help = 'What to do with URLs already in the DB',
+                        choices = ON_CONFLICT_CHOICES, default = 'update')
     args = parser.parse_args()
 
-    main(args.filename)
+    main(args.filename, args.batch_size, args.commit_every, args.on_conflict)
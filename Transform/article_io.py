@@ -0,0 +1,132 @@
+# Lectura y escritura de los archivos intermedios entre etapas.
+#
+# El formato se elige por la extensión del archivo: '.csv' (el de siempre),
+# '.parquet' o '.feather'. Los dos últimos guardan los tipos de cada columna
+# según el esquema de abajo, así que los conteos de palabras clave no se
+# vuelven float al releerlos y los cuerpos largos no pasan por el parseo y las
+# comillas del .csv. Los .feather se leen con memory map, sin copiar el
+# archivo a memoria. pyarrow sólo se necesita para parquet y feather.
+
+import os
+
+import pandas as pd
+
+# Esquema del archivo limpio que genera newspaper_recipe, en orden.
+CLEAN_SCHEMA = [
+    ('uid', 'string'),
+    ('headline', 'string'),
+    ('text', 'string'),
+    ('url', 'string'),
+    ('newspaper_uid', 'string'),
+    ('host', 'string'),
+    ('headline_tokens', 'int64'),
+    ('text_tokens', 'int64'),
+]
+
+FORMATS = ('csv', 'parquet', 'feather')
+
+
+def file_format(filename):
+    extension = os.path.splitext(filename)[1].lstrip('.').lower()
+    if extension not in FORMATS:
+        raise ValueError('Unsupported file format: {}'.format(filename))
+
+    return extension
+
+
+def read_articles(filename):
+    file_format_ = file_format(filename)
+    if file_format_ == 'csv':
+        return pd.read_csv(filename)
+
+    from pyarrow import feather, parquet
+
+    if file_format_ == 'parquet':
+        table = parquet.read_table(filename, memory_map = True)
+    else:
+        table = feather.read_table(filename, memory_map = True)
+
+    return table.to_pandas()
+
+
+# Lee el archivo en bloques de 'chunksize' filas.
+def iter_articles(filename, chunksize):
+    file_format_ = file_format(filename)
+    if file_format_ == 'csv':
+        yield from pd.read_csv(filename, chunksize = chunksize)
+        return
+
+    from pyarrow import feather, parquet
+
+    if file_format_ == 'parquet':
+        for batch in parquet.ParquetFile(filename, memory_map = True).iter_batches(batch_size = chunksize):
+            yield batch.to_pandas()
+    else:
+        # Con memory map, cada bloque sólo lee del disco las filas que toca.
+        table = feather.read_table(filename, memory_map = True)
+        for offset in range(0, table.num_rows, chunksize):
+            yield table.slice(offset, chunksize).to_pandas()
+
+
+# Escribe un DataFrame limpio (con 'uid' como índice) en el formato de 'filename'.
+def write_articles(df, filename):
+    with ArticleWriter(filename) as writer:
+        writer.write(df)
+
+
+# Escritor incremental: cada llamada a write agrega las filas al archivo.
+class ArticleWriter:
+    def __init__(self, filename, schema = CLEAN_SCHEMA):
+        self._filename = filename
+        self._format = file_format(filename)
+        self._columns = [name for name, _ in schema]
+        self._dtypes = dict(schema)
+        self._writer = None
+        self._rows = 0
+
+    def write(self, df):
+        if self._format == 'csv':
+            # El .csv conserva el índice 'uid' como primera columna, igual que
+            # antes; los conteos se escriben como enteros.
+            df = df.astype({name: dtype for name, dtype in self._dtypes.items()
+                            if dtype == 'int64' and name in df.columns})
+            df.to_csv(self._filename, mode = 'a' if self._rows else 'w', header = not self._rows)
+        else:
+            self._write_arrow(df)
+
+        self._rows += len(df)
+
+    def _write_arrow(self, df):
+        import pyarrow as pa
+        from pyarrow import parquet
+
+        df = df.reset_index() if df.index.name in self._columns else df
+        table = pa.Table.from_pandas(df[self._columns].astype(self._dtypes), schema = self._arrow_schema(),
+                                     preserve_index = False)
+        if self._writer is None:
+            if self._format == 'parquet':
+                self._writer = parquet.ParquetWriter(self._filename, table.schema)
+            else:
+                self._writer = pa.ipc.new_file(self._filename, table.schema)
+
+        self._writer.write_table(table)
+
+    def _arrow_schema(self):
+        import pyarrow as pa
+
+        types = {'string': pa.string(), 'int64': pa.int64()}
+        return pa.schema([(name, types[dtype]) for name, dtype in self._dtypes.items()])
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        # Un archivo sin filas también debe existir, con su esquema.
+        elif not self._rows and self._format != 'csv':
+            self._write_arrow(pd.DataFrame({name: pd.Series(dtype = dtype) for name, dtype in self._dtypes.items()}))
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,147 @@
+# Benchmark de las funciones de limpieza de newspaper_recipe.
+#
+# Toma los clean_*_articles.csv del repositorio, los repite hasta tener --rows
+# filas y mide cada paso con la implementación actual y con la original
+# (fila por fila con apply/applymap), copiada abajo. También verifica que
+# ambas produzcan exactamente las mismas columnas.
+#
+# Uso: python benchmark_recipe.py --rows 100000
+
+import argparse
+import glob
+import hashlib
+import logging
+import os
+import time
+
+import nltk
+import pandas as pd
+from nltk.corpus import stopwords
+
+import newspaper_recipe
+
+logger = logging.getLogger(__name__)
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Corpus de prueba: headline, text y url de los .csv limpios, repetidos hasta
+# tener 'rows' filas. Las filas sin texto se descartan, porque la versión
+# original de _remove_new_lines no las acepta. A cada copia se le agrega un
+# parámetro a la url para que las uids no se repitan. Uno de cada diez títulos
+# se borra para ejercitar _fill_missing_titles (sólo en urls de las que se
+# puede sacar un título).
+def _corpus(rows):
+    files = sorted(glob.glob(os.path.join(_root, 'clean_*_articles.csv')))
+    base = pd.concat([pd.read_csv(f, usecols = ['headline', 'text', 'url']) for f in files],
+                     ignore_index = True)
+    base = base.dropna(subset = ['text']).reset_index(drop = True)
+    copies = -(-rows // len(base))
+    df = pd.concat([base] * copies, ignore_index = True).iloc[:rows].copy()
+    df['url'] = df['url'] + '?copy=' + (df.index // len(base)).astype(str)
+
+    has_title_in_url = df['url'].str.contains(r'[a-z]+-.+$')
+    df.loc[has_title_in_url & (df.index % 10 == 0), 'headline'] = float('nan')
+
+    return df
+
+
+# Implementación original, fila por fila.
+def _legacy_tokenized_items(df, column_name):
+    stop_words = set(stopwords.words('spanish'))
+    n_tokens = (df.dropna()
+                .apply(lambda row: nltk.word_tokenize(row[column_name]), axis = 1)
+                .apply(lambda tokens: list(filter(lambda token: token.isalpha(), tokens)))
+                .apply(lambda tokens: list(map(lambda token: token.lower(), tokens)))
+                .apply(lambda word_list: list(filter(lambda word: word not in stop_words, word_list)))
+                .apply(lambda valid_words: len(valid_words))
+               )
+    df[column_name + '_tokens'] = n_tokens
+
+    return df
+
+
+def _legacy_remove_new_lines(df):
+    stripped_body = (df.apply(lambda row: row['text'], axis = 1)
+                       .apply(lambda body: body.replace('\n', ''))
+                       .apply(lambda body: body.replace('\r', ''))
+                    )
+    df['text'] = stripped_body
+
+    return df
+
+
+def _legacy_uids_generator(df):
+    uids = (df.apply(lambda row: hashlib.md5(bytes(row['url'].encode())), axis = 1)
+              .apply(lambda hash_object: hash_object.hexdigest())
+           )
+    df['uid'] = uids
+
+    return df.set_index('uid')
+
+
+def _legacy_fill_missing_titles(df):
+    missing_titles_mask = df['headline'].isna()
+    missing_titles = (df[missing_titles_mask]['url']
+                  .str.extract(r'(?P<missing_titles>[a-z]+-.+)$')
+                  .applymap(lambda title: title.split('-'))
+                  .applymap(lambda title_word_list: ' '.join(title_word_list))
+                  .applymap(lambda title: title.capitalize())
+                  .applymap(lambda title: title.replace('/',''))
+                 )
+    df.loc[missing_titles_mask, 'headline'] = missing_titles.loc[:, 'missing_titles']
+
+    return df
+
+
+# Pasos en el mismo orden que newspaper_recipe.transform: (nombre, original, actual).
+_steps = [
+    ('_fill_missing_titles', _legacy_fill_missing_titles, newspaper_recipe._fill_missing_titles),
+    ('_uids_generator', _legacy_uids_generator, newspaper_recipe._uids_generator),
+    ('_remove_new_lines', _legacy_remove_new_lines, newspaper_recipe._remove_new_lines),
+    ('_tokenized_items(headline)',
+     lambda df: _legacy_tokenized_items(df, 'headline'),
+     lambda df: newspaper_recipe._tokenized_items(df, 'headline')),
+    ('_tokenized_items(text)',
+     lambda df: _legacy_tokenized_items(df, 'text'),
+     lambda df: newspaper_recipe._tokenized_items(df, 'text')),
+]
+
+
+def _timed(function, df):
+    start = time.perf_counter()
+    result = function(df)
+
+    return result, time.perf_counter() - start
+
+
+def main(rows):
+    df = _corpus(rows)
+    print('{} rows'.format(len(df)))
+    print('{:<28}{:>12}{:>12}{:>10}'.format('step', 'legacy (s)', 'current (s)', 'speedup'))
+
+    legacy_df, current_df = df.copy(), df.copy()
+    legacy_total = current_total = 0
+    for name, legacy, current in _steps:
+        legacy_df, legacy_time = _timed(legacy, legacy_df)
+        current_df, current_time = _timed(current, current_df)
+        # Las dos versiones deben dejar el DataFrame idéntico.
+        pd.testing.assert_frame_equal(legacy_df, current_df)
+
+        legacy_total += legacy_time
+        current_total += current_time
+        print('{:<28}{:>12.3f}{:>12.3f}{:>9.1f}x'.format(name, legacy_time, current_time, legacy_time / current_time))
+
+    print('{:<28}{:>12.3f}{:>12.3f}{:>9.1f}x'.format('total', legacy_total, current_total, legacy_total / current_total))
+
+
+if __name__ == '__main__':
+    # Los mensajes de cada paso de newspaper_recipe ensucian la tabla.
+    logging.getLogger('newspaper_recipe').setLevel(logging.WARNING)
+    # Se mide la tokenización en sí, no el caché de conteos.
+    newspaper_recipe.disable_token_cache()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', help = 'Number of rows in the benchmark corpus', type = int, default = 100000)
+    args = parser.parse_args()
+
+    main(args.rows)
@@ -0,0 +1,152 @@
+# Índice de notas casi repetidas (MinHash + LSH) sobre la columna 'text'.
+#
+# Las notas de agencias aparecen casi iguales en varios periódicos y en días
+# distintos, así que comparar títulos exactos no basta. Cada cuerpo se
+# convierte en un conjunto de 'shingles' (grupos de SHINGLE_SIZE palabras) y
+# luego en una firma MinHash de NUM_PERM valores: la fracción de valores
+# iguales entre dos firmas estima la similitud de Jaccard entre los textos.
+# Para no comparar contra todo el corpus, la firma se parte en BANDS bandas y
+# cada banda se guarda en una tabla indexada: sólo se comparan las notas que
+# comparten al menos una banda completa (LSH), así que la búsqueda no crece
+# con el tamaño del índice. El índice vive en un SQLite junto a la base de
+# datos de Load y se actualiza con cada lote que pasa por la receta.
+#
+# filter() deja sus cambios (las notas conservadas y, con 'longest', las
+# copias reemplazadas) en una transacción abierta: quien guarda o carga el
+# lote llama a commit() cuando terminó bien, o a rollback() si falló, para que
+# una nota que nunca llegó a la base de datos no cuente como copia canónica.
+
+import hashlib
+import re
+import sqlite3
+import time
+import zlib
+
+import numpy as np
+
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 5
+DEFAULT_THRESHOLD = 0.8
+
+# Qué copia se conserva cuando una nota es casi igual a una ya indexada:
+# 'first': la primera que se vio; las siguientes se descartan.
+# 'longest': la de cuerpo más largo; una copia posterior más larga se conserva
+#            y pasa a ser la canónica.
+# 'keep': no se descarta nada; sólo se actualiza el índice.
+POLICIES = ('first', 'longest', 'keep')
+
+_words = re.compile(r'\w+')
+_mask = np.uint64(0xFFFFFFFF)
+# Coeficientes fijos (semilla constante) para que las firmas sean las mismas
+# en todas las corridas y procesos.
+_random = np.random.RandomState(20220407)
+_a = _random.randint(1, 2 ** 32, size = NUM_PERM, dtype = np.uint64) | np.uint64(1)
+_b = _random.randint(0, 2 ** 32, size = NUM_PERM, dtype = np.uint64)
+
+
+# Firma MinHash de un texto: para cada una de las NUM_PERM funciones
+# (a * x + b) mod 2^32, el mínimo sobre los hashes de los shingles.
+def signature(text):
+    words = _words.findall(text.lower())
+    shingles = {' '.join(words[i:i + SHINGLE_SIZE])
+                for i in range(max(1, len(words) - SHINGLE_SIZE + 1))}
+    hashes = np.fromiter((zlib.crc32(shingle.encode()) for shingle in shingles),
+                         dtype = np.uint64, count = len(shingles))
+
+    return ((_a[:, None] * hashes[None, :] + _b[:, None]) & _mask).min(axis = 1).astype(np.uint32)
+
+
+def similarity(signature_a, signature_b):
+    return float(np.mean(signature_a == signature_b))
+
+
+def _band_keys(sig):
+    return [hashlib.blake2b(sig[band * ROWS:(band + 1) * ROWS].tobytes(), digest_size = 8).digest()
+            for band in range(BANDS)]
+
+
+class NearDuplicateIndex:
+    def __init__(self, path, threshold = DEFAULT_THRESHOLD):
+        self._threshold = threshold
+        # timeout: el recipe por línea de comandos puede escribir en el índice
+        # mientras pipeline.py carga.
+        self._db = sqlite3.connect(path, timeout = 30)
+        self._db.execute('PRAGMA journal_mode = WAL')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS signatures (
+                                uid TEXT PRIMARY KEY,
+                                newspaper_uid TEXT,
+                                text_length INTEGER NOT NULL,
+                                signature BLOB NOT NULL,
+                                added REAL NOT NULL)''')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS bands (
+                                band INTEGER NOT NULL,
+                                bucket BLOB NOT NULL,
+                                uid TEXT NOT NULL)''')
+        self._db.execute('CREATE INDEX IF NOT EXISTS bands_lookup ON bands (band, bucket)')
+        self._db.commit()
+
+    # Devuelve (uid, similitud, largo del texto) de la nota indexada más
+    # parecida a 'sig' por encima del umbral, sin contar a 'uid' misma, o None.
+    def find(self, sig, uid = None):
+        candidates = set()
+        for band, bucket in enumerate(_band_keys(sig)):
+            candidates.update(row[0] for row in self._db.execute(
+                'SELECT uid FROM bands WHERE band = ? AND bucket = ?', (band, bucket)))
+        candidates.discard(uid)
+
+        best = None
+        for candidate in candidates:
+            row = self._db.execute('SELECT signature, text_length FROM signatures WHERE uid = ?',
+                                   (candidate,)).fetchone()
+            if row is None:
+                continue
+            score = similarity(sig, np.frombuffer(row[0], dtype = np.uint32))
+            if score >= self._threshold and (best is None or score > best[1]):
+                best = (candidate, score, row[1])
+
+        return best
+
+    def add(self, uid, newspaper_uid, text_length, sig):
+        self._db.execute('DELETE FROM bands WHERE uid = ?', (uid,))
+        self._db.execute('''INSERT OR REPLACE INTO signatures (uid, newspaper_uid, text_length, signature, added)
+                            VALUES (?, ?, ?, ?, ?)''',
+                         (uid, newspaper_uid, text_length, sig.tobytes(), time.time()))
+        self._db.executemany('INSERT INTO bands VALUES (?, ?, ?)',
+                             [(band, bucket, uid) for band, bucket in enumerate(_band_keys(sig))])
+
+    # Quita del índice una nota que dejó de ser la copia canónica.
+    def remove(self, uid):
+        self._db.execute('DELETE FROM bands WHERE uid = ?', (uid,))
+        self._db.execute('DELETE FROM signatures WHERE uid = ?', (uid,))
+
+    # Revisa las filas de un DataFrame (índice 'uid', columnas text y
+    # newspaper_uid) en orden, agrega al índice las que se conservan y
+    # devuelve la máscara de filas a conservar según 'policy'. Los cambios
+    # quedan sin confirmar hasta commit().
+    def filter(self, df, policy = 'first'):
+        keep = []
+        for uid, text, newspaper_uid in zip(df.index, df['text'], df['newspaper_uid']):
+            sig = signature(text)
+            match = self.find(sig, uid)
+
+            if match is None or policy == 'keep':
+                kept = True
+            elif policy == 'longest' and len(text) > match[2]:
+                self.remove(match[0])
+                kept = True
+            else:
+                kept = False
+
+            if kept:
+                self.add(uid, newspaper_uid, len(text), sig)
+            keep.append(kept)
+
+        return np.array(keep, dtype = bool)
+
+    def commit(self):
+        self._db.commit()
+
+    def rollback(self):
+        self._db.rollback()
@@ -5,14 +5,43 @@ logging.basicConfig(level = logging.INFO)
 # Permite identificar elementos en una url.
 from urllib.parse import urlparse
 import pandas as pd
+import contextlib
 import hashlib
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 # La librería nltk se usa para identificar palabras clave.
 import nltk
-from nltk.corpus import stopwords
+
+import article_io
+from near_duplicates import NearDuplicateIndex
+from token_cache import TokenCache
+
+# metrics.py y stop_words.py viven en la raíz del repositorio.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics
+# Lista de palabras clave vacías, la misma que usa Load/search.py.
+from stop_words import STOPWORDS_LANGUAGE, stop_words as _stop_words
 
 logger = logging.getLogger(__name__)
 
+# Caché de conteos de palabras clave (ver token_cache). Se abre uno por
+# proceso la primera vez que se usa; con disable_token_cache no se usa.
+TOKEN_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'token_cache.db')
+TOKEN_CACHE_MAX_ENTRIES = 2000000
+_token_cache = None
+_token_cache_pid = None
+_token_cache_enabled = True
+# Índice de notas casi repetidas (ver near_duplicates). Vive junto a la base
+# de datos de Load (o la de NEWSPAPER_DB) y se abre uno por proceso.
+# La política dice qué copia se conserva; con None no se usa el índice.
+NEAR_DUPLICATES_POLICY = 'first'
+_near_duplicates = None
+_near_duplicates_pid = None
+_near_duplicates_path = None
+
 
 def main(filename):
     logger.info('Starting cleaning process...')
@@ -21,6 +50,73 @@ def main(filename):
     df = _read_data(filename)
     # Extraer el uid del periódico, es decir, el nombre del periódico.
     newspaper_uid = _extract_newspaper_uid(filename)
+    df = transform(df, newspaper_uid)
+    # Se guarda el DataFrame en disco, sin las notas casi repetidas.
+    with without_near_duplicates(df) as df:
+        _save_data(df, filename)
+
+    return df
+
+
+# Modo por bloques para archivos grandes: lee chunksize filas a la vez, limpia
+# y tokeniza los bloques en un pool de 'jobs' procesos y va agregando el
+# resultado al .csv limpio. Sólo hay unos cuantos bloques en memoria a la vez.
+# Devuelve el número de filas guardadas.
+def main_chunked(filename, chunksize, jobs = 1):
+    logger.info('Starting chunked cleaning process...')
+    newspaper_uid = _extract_newspaper_uid(filename)
+    clean_filename = 'clean_{}'.format(filename)
+    # Títulos de los bloques anteriores, para que los repetidos se eliminen
+    # aunque queden en bloques distintos.
+    seen_headlines = set()
+    rows = 0
+
+    with ProcessPoolExecutor(max_workers = jobs) as executor, article_io.ArticleWriter(clean_filename) as writer:
+        chunks = article_io.iter_articles(filename, chunksize)
+        for i, df in enumerate(_map_bounded(executor, _clean, chunks, newspaper_uid, window = 2 * jobs)):
+            # Los bloques llegan en el orden del archivo, así que 'keep first'
+            # se respeta igual que con el archivo completo.
+            df = _remove_seen(df, 'headline', seen_headlines)
+            df = _drop_rows_with_missing_values(df)
+            with without_near_duplicates(df) as df:
+                logger.info('Saving chunk {} ({} rows) at {}'.format(i, len(df), clean_filename))
+                writer.write(df)
+            rows += len(df)
+
+    return rows
+
+
+# Como executor.map, pero con a lo más 'window' bloques enviados al pool a la
+# vez, para no leer todo el archivo antes de que termine el primer bloque.
+def _map_bounded(executor, function, items, *args, window):
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(function, item, *args))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
+# Aplica la limpieza completa a un DataFrame con las columnas headline, text
+# y url. La usan main (desde un .csv) y pipeline.py (en memoria).
+# Si los datos llegan por lotes, seen_headlines es un set compartido entre
+# lotes para que la eliminación de títulos repetidos abarque todos ellos.
+# Las notas casi repetidas no se quitan aquí sino al guardar o cargar el
+# resultado (ver without_near_duplicates).
+def transform(df, newspaper_uid, seen_headlines = None):
+    df = _clean(df, newspaper_uid)
+    if seen_headlines is not None:
+        df = _remove_seen(df, 'headline', seen_headlines)
+    df = _drop_rows_with_missing_values(df)
+
+    return df
+
+
+# Pasos de la limpieza que sólo dependen de las filas del propio DataFrame,
+# incluida la eliminación de títulos repetidos dentro de él.
+def _clean(df, newspaper_uid):
     # Añade una columna para el uid del periódico.
     df = _add_newspaper_uid_column(df, newspaper_uid)
     # Se extrae el host.
@@ -36,21 +132,20 @@ def main(filename):
     df = _tokenized_items(df, 'text')
     # Se eliminan los duplicados en los títulos de las noticias
     _remove_duplicates(df, 'headline')
-    df = _drop_rows_with_missing_values(df)
-    # Se guarda el DataFrame en disco. 
-    _save_data(df, filename)
 
     return df
 
 
-# Se guarda el DataFrame en disco.
+# Se guarda el DataFrame en disco, en el formato de 'filename' (.csv,
+# .parquet o .feather; ver article_io).
 def _save_data(df, filename):
     clean_filename = 'clean_{}'.format(filename)
     logger.info('Saving database at {}'.format(clean_filename))
-    df.to_csv(clean_filename)
+    article_io.write_articles(df, clean_filename)
 
 
 # Se eliminan los duplicados en los títulos de las noticias.
+@metrics.track_rows('etl_transform')
 def _remove_duplicates(df, column_name):
     logger.info('Removing repeated entries...')
     #El parámetro keep = 'first' especifica que se mantenga el primer valor 
@@ -61,30 +156,105 @@ def _remove_duplicates(df, column_name):
     return
 
 
+# Elimina las filas cuyo valor en column_name ya apareció en un lote anterior
+# y agrega los valores del lote actual al set 'seen'.
+def _remove_seen(df, column_name, seen):
+    df = df[~df[column_name].isin(seen)]
+    seen.update(df[column_name])
+
+    return df
+
+
+# Quita de df las notas casi repetidas justo antes de guardarlo o cargarlo:
+#
+#     with newspaper_recipe.without_near_duplicates(df) as df:
+#         loader.load(df)
+#
+# Las notas conservadas pasan a ser copias canónicas en el índice sólo si el
+# bloque with termina sin error; si falla, los cambios al índice se deshacen.
+# pipeline.py y crawl_daemon.py lo usan en el proceso que carga, uno a la vez,
+# para que las notas de un sitio se comparen con las de los demás sitios de la
+# misma corrida.
+@contextlib.contextmanager
+def without_near_duplicates(df):
+    index = _get_near_duplicates_index()
+    if index is None:
+        yield df
+        return
+
+    try:
+        yield _remove_near_duplicates(df)
+    except BaseException:
+        index.rollback()
+        raise
+    index.commit()
+
+
+# Descarta las notas casi iguales a otras ya vistas (en este u otro periódico,
+# en esta o en corridas anteriores) según NEAR_DUPLICATES_POLICY, y agrega al
+# índice las que se conservan (sin confirmar; ver without_near_duplicates).
+@metrics.track_rows('etl_transform')
+def _remove_near_duplicates(df):
+    index = _get_near_duplicates_index()
+    if index is None:
+        return df
+
+    logger.info('Removing near-duplicate articles ({} policy)...'.format(NEAR_DUPLICATES_POLICY))
+    keep = index.filter(df, NEAR_DUPLICATES_POLICY)
+    if not keep.all():
+        logger.info('Dropped {} near-duplicate articles'.format(int((~keep).sum())))
+
+    return df[keep]
+
+
+# Cambia la política de notas casi repetidas ('first', 'longest', 'keep') o
+# la desactiva con None.
+def set_near_duplicates_policy(policy):
+    global NEAR_DUPLICATES_POLICY
+    NEAR_DUPLICATES_POLICY = policy
+
+
+def _get_near_duplicates_index():
+    global _near_duplicates, _near_duplicates_pid, _near_duplicates_path
+    if NEAR_DUPLICATES_POLICY is None:
+        return None
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    db_path = os.environ.get('NEWSPAPER_DB', os.path.join(root, 'Load', 'newspaper.db'))
+    path = os.path.join(os.path.dirname(db_path), 'near_duplicates.db')
+    # También se abre de nuevo si NEWSPAPER_DB cambió (ver run_benchmark).
+    if _near_duplicates is None or _near_duplicates_pid != os.getpid() or _near_duplicates_path != path:
+        _near_duplicates = NearDuplicateIndex(path)
+        _near_duplicates_pid = os.getpid()
+        _near_duplicates_path = path
+
+    return _near_duplicates
+
+
+@metrics.track_rows('etl_transform')
 def _drop_rows_with_missing_values(df):
     logger.info('Dropping rows wuth missing values...')
     return df.dropna()
 
 
 # Genera los tokens para 'headline' y 'text'.
+@metrics.track_rows('etl_transform')
 def _tokenized_items(df, column_name):
     logger.info('Adding token count for {}...'.format(column_name))
-    # Se declara que la lista de palabras clave son en español.
-    stop_words = set(stopwords.words('spanish'))    
-
-    # Se eliminan los valores nulos.
-    # Se separa el texto por cada palabra.
-    # Se filtran las palabras que no son alfanuméricas.
-    # Se convierten las palabras clave en minúsculas.
-    # Se filtran las palabras que no pertenecen al set stop_words.
-    # Se obtiene la cantidad de palabras clave de la columna seleccionada. 
-    n_tokens = (df.dropna()
-                .apply(lambda row: nltk.word_tokenize(row[column_name]), axis = 1)
-                .apply(lambda tokens: list(filter(lambda token: token.isalpha(), tokens)))
-                .apply(lambda tokens: list(map(lambda token: token.lower(), tokens)))
-                .apply(lambda word_list: list(filter(lambda word: word not in stop_words, word_list)))
-                .apply(lambda valid_words: len(valid_words))
-               )
+    # Lista de palabras clave en español, construida una sola vez por proceso.
+    stop_words = _stop_words()
+
+    # Se eliminan los valores nulos y se cuentan las palabras clave de cada
+    # fila en una sola pasada (ver _count_tokens). Los textos que ya están en
+    # el caché no se vuelven a tokenizar.
+    valid_rows = df.dropna()
+    texts = valid_rows[column_name].tolist()
+    cache = _get_token_cache()
+    if cache is not None:
+        counts = cache.counts(texts, STOPWORDS_LANGUAGE, lambda text: _count_tokens(text, stop_words))
+    else:
+        counts = [_count_tokens(text, stop_words) for text in texts]
+    n_tokens = pd.Series(counts, index = valid_rows.index, dtype = 'int64')
 
     # Se crea la columna 'headline_tokens' y 'text_tokens' para cada caso, que contiene
     # el número de palabras claves en ambas.
@@ -92,41 +262,62 @@ def _tokenized_items(df, column_name):
 
     return df
 
+
+# Desactiva el caché de conteos; todo se tokeniza de nuevo.
+def disable_token_cache():
+    global _token_cache_enabled
+    _token_cache_enabled = False
+
+
+def _get_token_cache():
+    global _token_cache, _token_cache_pid
+    if not _token_cache_enabled:
+        return None
+
+    if _token_cache is None or _token_cache_pid != os.getpid():
+        _token_cache = TokenCache(TOKEN_CACHE_PATH, TOKEN_CACHE_MAX_ENTRIES)
+        _token_cache_pid = os.getpid()
+
+    return _token_cache
+
+
+# Cuenta las palabras clave de un texto:
+# Se separa el texto por cada palabra.
+# Se filtran las palabras que no son alfanuméricas.
+# Se convierten las palabras clave en minúsculas.
+# Se filtran las palabras que no pertenecen al set stop_words.
+def _count_tokens(text, stop_words):
+    return sum(1 for token in nltk.word_tokenize(text)
+               if token.isalpha() and token.lower() not in stop_words)
+
+
 # Eliminar saltos de línea y basura.
+@metrics.track_rows('etl_transform')
 def _remove_new_lines(df):
     logger.info('Removing newlines and thingys...')
-    # Se obtienen los valores por fila, como se indica con axis = 1. Si no se 
-    # especificara, se aplicaría el mismo valor a todos los elementos de la columna (?).
-    # stripped_body es un objeto Series de Pandas.
-    stripped_body = (df.apply(lambda row: row['text'], axis = 1)
-                       .apply(lambda body: body.replace('\n', ''))
-                       .apply(lambda body: body.replace('\r', ''))
-                    )
-    
-    # A la columna 'text' del DataFrame se asigna la Series de Pandas 'stripped_body'
-    df['text'] = stripped_body
+    # Se quitan los '\n' y '\r' de toda la columna a la vez con el accesor .str.
+    # Dos reemplazos literales son más rápidos que una expresión regular.
+    df['text'] = df['text'].str.replace('\n', '', regex = False).str.replace('\r', '', regex = False)
 
     return df
 
 # Genera un UID para cada noticia scrapeada.
+@metrics.track_rows('etl_transform')
 def _uids_generator(df):
     logger.info('Generating UID\'s for each new')
-    # Al DataFrame aplica la función que genera un hash a partir del url.
-    # El método md5 de la clase hashlib recibe una lista de bytes, por lo que
-    # se convierte el resultado de la transformación con la función bytes().
-    # Se indica que se obtenga el valor del eje de las filas con axis = 1.
-    # El objeto hash se convierte en una cadena hexadecimal de 16 dígitos.
-    uids = (df.apply(lambda row: hashlib.md5(bytes(row['url'].encode())), axis = 1)
-              .apply(lambda hash_object: hash_object.hexdigest())
-           )
+    # A cada url se le aplica la función que genera un hash.
+    # El método md5 de la clase hashlib recibe bytes, por lo que la url se
+    # codifica con encode().
+    # El objeto hash se convierte en una cadena hexadecimal de 32 dígitos.
     # Se crea la columna uid y se les asignan los uids.
-    df['uid'] = uids 
+    df['uid'] = [hashlib.md5(url.encode()).hexdigest() for url in df['url']]
     
     # Se asigna como índice la columna 'uid'.
     return df.set_index('uid')
 
 
 # Rellena los valores de la columna 'title' que sean NaN.
+@metrics.track_rows('etl_transform')
 def _fill_missing_titles(df):
     logger.info('Filling missing titles')
     # Devuelve True para los valores en la columna 'headline' que sean NaN y False para los que sean distintos de NaN.
@@ -135,22 +326,20 @@ def _fill_missing_titles(df):
     # Para todos los elementos cuyo valor en 'headline' sea NaN, obtiene su valor en 'url'.
     # De la url, extrae la cadena que coincida con la RegEx "empieza con uno o más caracteres alfanuméricos, seguido(s)
     # de un guion '-', seguido de uno o más caracter cualesquiera".
-    # Luego, divide por cada guion '-'.
-    # Con la función join une el resultado por medio de espacio, se pone en mayúscula
-    # la primera letra de la cadena y se reemplaza el posible slash '/' al final de la
-    # dirección de la noticia. 
+    # Luego, cambia cada guion '-' por un espacio, pone en mayúscula la primera
+    # letra de la cadena y elimina el posible slash '/' al final de la
+    # dirección de la noticia.
     # Esta columna se guarda en missing_titles, que es una Series de Pandas.
-    missing_titles = (df[missing_titles_mask]['url']
-                  .str.extract(r'(?P<missing_titles>[a-z]+-.+)$')
-                  .applymap(lambda title: title.split('-'))
-                  .applymap(lambda title_word_list: ' '.join(title_word_list))
-                  .applymap(lambda title: title.capitalize())
-                  .applymap(lambda title: title.replace('/',''))
+    missing_titles = (df.loc[missing_titles_mask, 'url']
+                  .str.extract(r'(?P<missing_titles>[a-z]+-.+)$', expand = False)
+                  .str.replace('-', ' ', regex = False)
+                  .str.capitalize()
+                  .str.replace('/', '', regex = False)
                  )
 
     # Para todos los elementos del dataframe con valor en 'headline' igual a NaN,
     # asigna los elementos de la Series missing_titles de la columna 'missing_titles'.
-    df.loc[missing_titles_mask, 'headline'] = missing_titles.loc[:, 'missing_titles']
+    df.loc[missing_titles_mask, 'headline'] = missing_titles
 
     return df
 
@@ -166,6 +355,7 @@ def _extract_newspaper_uid(filename):
 
 
 # Añade una columna para el uid del periódico.
+@metrics.track_rows('etl_transform')
 def _add_newspaper_uid_column(df, newspaper_uid):
     logger.info('Filling newspaper uid column with {}'.format(newspaper_uid))
     # Se crea la columna y se añade a cada elemento el mismo uid.
@@ -175,6 +365,7 @@ def _add_newspaper_uid_column(df, newspaper_uid):
 
 
 # Se extrae el host.
+@metrics.track_rows('etl_transform')
 def _extract_host(df):
     logger.info('Extracting host from URL...')
     # Crea una columna 'host', a la cual se aplica la función lambda que extrae el host por medio del método urlparse()
@@ -184,11 +375,11 @@ def _extract_host(df):
     return df
 
 
-#Se lee desde archivo .csv
+#Se lee desde archivo .csv, .parquet o .feather.
 def _read_data(filename):
     logger.info('Reading file {}'.format(filename))
     
-    return pd.read_csv(filename)
+    return article_io.read_articles(filename)
 
 
 if __name__ == '__main__':
@@ -196,5 +387,19 @@ if __name__ == '__main__':
     # Se envía el nombre del archivo a ser limpiado. Ej: lajornada_07-04-2022_articles.csv
     # Se crea el argumento filename para que pueda ingresarse por el usuari.
     parser.add_argument('filename', help = 'The path to the dirty data', type = str)
+    # Con --chunksize el archivo se procesa por bloques, en --jobs procesos.
+    parser.add_argument('--chunksize', help = 'Rows per chunk; process the file out of core', type = int)
+    parser.add_argument('--jobs', help = 'Processes used to tokenize chunks', type = int, default = 1)
+    # Tokeniza todo de nuevo sin consultar ni actualizar el caché de conteos.
+    parser.add_argument('--no-token-cache', help = 'Do not use the token count cache', action = 'store_true')
+    # Qué copia conservar de las notas casi repetidas ('off' desactiva el índice).
+    parser.add_argument('--near-duplicates', help = 'Near-duplicate canonical-copy policy',
+                        choices = ('first', 'longest', 'keep', 'off'), default = NEAR_DUPLICATES_POLICY)
     args = parser.parse_args()
-    df = main(args.filename)
+    if args.no_token_cache:
+        disable_token_cache()
+    set_near_duplicates_policy(None if args.near_duplicates == 'off' else args.near_duplicates)
+    if args.chunksize:
+        main_chunked(args.filename, args.chunksize, args.jobs)
+    else:
+        df = main(args.filename)
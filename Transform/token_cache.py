@@ -0,0 +1,76 @@
+# Caché persistente del conteo de palabras clave.
+#
+# _tokenized_items cuenta las palabras clave de cada título y cuerpo con
+# nltk.word_tokenize, que es la parte más lenta de la limpieza. Muchas notas
+# regresan sin cambios en corridas posteriores, así que el conteo se guarda en
+# un SQLite con llave sha1(idioma + texto) y sólo se tokeniza lo que no está.
+# Cuando hay más de max_entries conteos se borran los usados hace más tiempo.
+
+import hashlib
+import sqlite3
+import time
+
+# Máximo de variables por consulta con 'IN (...)' (SQLite acepta 999 en
+# versiones antiguas).
+_BATCH = 500
+
+
+class TokenCache:
+    def __init__(self, path, max_entries):
+        self._max_entries = max_entries
+        # timeout: en el modo por bloques varios procesos escriben a la vez.
+        self._db = sqlite3.connect(path, timeout = 30)
+        self._db.execute('PRAGMA journal_mode = WAL')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS token_counts (
+                                key BLOB PRIMARY KEY,
+                                count INTEGER NOT NULL,
+                                last_used REAL NOT NULL)''')
+        self._db.execute('CREATE INDEX IF NOT EXISTS token_counts_last_used ON token_counts (last_used)')
+        self._db.commit()
+
+    # Devuelve el conteo de cada texto de 'texts', en el mismo orden.
+    # count_tokens(text) sólo se llama con los textos que no están en el caché.
+    def counts(self, texts, language, count_tokens):
+        keys = [_key(text, language) for text in texts]
+        cached = self._get_many(set(keys))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = count_tokens(text)
+
+        now = time.time()
+        self._db.executemany('INSERT OR REPLACE INTO token_counts VALUES (?, ?, ?)',
+                             [(key, count, now) for key, count in missing.items()])
+        self._touch(cached, now)
+        self._evict()
+        self._db.commit()
+
+        cached.update(missing)
+        return [cached[key] for key in keys]
+
+    def _get_many(self, keys):
+        keys = list(keys)
+        found = {}
+        for i in range(0, len(keys), _BATCH):
+            batch = keys[i:i + _BATCH]
+            query = 'SELECT key, count FROM token_counts WHERE key IN ({})'.format(','.join('?' * len(batch)))
+            found.update(self._db.execute(query, batch))
+
+        return found
+
+    # Marca los conteos usados en esta corrida como recientes.
+    def _touch(self, keys, now):
+        self._db.executemany('UPDATE token_counts SET last_used = ? WHERE key = ?',
+                             [(now, key) for key in keys])
+
+    # Borra los conteos menos usados si se rebasa max_entries.
+    def _evict(self):
+        excess = self._db.execute('SELECT COUNT(*) FROM token_counts').fetchone()[0] - self._max_entries
+        if excess > 0:
+            self._db.execute('''DELETE FROM token_counts WHERE key IN (
+                                    SELECT key FROM token_counts ORDER BY last_used LIMIT ?)''', (excess,))
+
+
+def _key(text, language):
+    return hashlib.sha1('{}\0{}'.format(language, text).encode()).digest()
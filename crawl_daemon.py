@@ -0,0 +1,233 @@
+# Servicio residente del ETL.
+#
+# En lugar de correr pipeline.py desde cron, con un intérprete nuevo en cada
+# corrida que vuelve a importar pandas, nltk y bs4, a leer config.yaml y a
+# abrir la base de datos, este proceso se queda corriendo. El pool de procesos
+# se crea una sola vez, con las librerías ya importadas, y sus procesos
+# conservan entre corridas las sesiones HTTP, los parsers de cada sitio, la
+# lista de palabras clave y los cachés de tokens. La carga se hace en este
+# proceso con el mismo Engine de Load.
+#
+# Cada sitio corre cada 'interval_minutes' (sección 'daemon' de config.yaml o
+# la sección del sitio) más un retraso al azar de hasta 'jitter_seconds', para
+# no pedir todos los sitios al mismo tiempo. Un sitio no vuelve a empezar
+# mientras su corrida anterior sigue en curso. Si config.yaml cambia, se
+# vuelve a leer antes de programar y de correr el siguiente sitio; los sitios
+# nuevos corren de inmediato y los que se quitaron dejan de programarse.
+# SIGINT o SIGTERM detienen el servicio cuando terminan los sitios en curso.
+#
+# Uso: python crawl_daemon.py --jobs 4 --workers 8
+
+import argparse
+import datetime
+import logging
+logging.basicConfig(level = logging.INFO)
+import os
+import random
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+# pipeline agrega las carpetas de las etapas al path.
+import pipeline
+import common
+import metrics
+import news_page_objects as news
+import newspaper_recipe
+import page_parser
+
+logger = logging.getLogger(__name__)
+
+# Valores por defecto de la sección 'daemon' de config.yaml.
+DEFAULTS = {
+    'interval_minutes': 30,
+    'jitter_seconds': 120,
+    'poll_seconds': 5,
+}
+
+
+class CrawlDaemon:
+    def __init__(self, jobs = 1, sites = None, metrics_dir = pipeline.DEFAULT_METRICS_DIR, workers = 1):
+        self._jobs = jobs
+        # Artículos que cada sitio descarga a la vez.
+        self._workers = workers
+        # Sitios elegidos con --sites, o None para todos los de config.yaml.
+        self._only_sites = sites
+        self._metrics_dir = metrics_dir
+        # Momento (time.monotonic) de la siguiente corrida de cada sitio.
+        self._next_run = {}
+        # Corridas en curso: future -> news_site_uid.
+        self._running = {}
+        self._stopping = False
+        self._started = datetime.datetime.now()
+        self._executor = None
+
+    def stop(self, *args):
+        if not self._stopping:
+            logger.info('Stopping once the running sites finish...')
+        self._stopping = True
+
+    def run(self):
+        metrics.reset()
+        _reload_config()
+        # Se carga antes de crear el pool para que sus procesos la hereden.
+        newspaper_recipe._stop_words()
+
+        self._executor = self._new_pool()
+        try:
+            while not self._stopping or self._running:
+                if not self._stopping:
+                    self._schedule()
+                    self._submit_due()
+                self._collect(self._wait_seconds())
+        finally:
+            self._executor.shutdown()
+
+        logger.info('Crawl daemon stopped')
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers = self._jobs, initializer = _ignore_interrupts)
+
+    def _settings(self):
+        return dict(DEFAULTS, **(common.config().get('daemon') or {}))
+
+    def _sites(self):
+        sites = common.config()['news_sites']
+        return [news_site_uid for news_site_uid in sites
+                if self._only_sites is None or news_site_uid in self._only_sites]
+
+    # Recarga config.yaml si cambió y ajusta los sitios programados.
+    def _schedule(self):
+        try:
+            if _reload_config():
+                logger.info('config.yaml changed, configuration reloaded')
+        except Exception:
+            logger.exception('Could not reload config.yaml, keeping the previous configuration')
+
+        sites = self._sites()
+        for news_site_uid in list(self._next_run):
+            if news_site_uid not in sites:
+                logger.info('{} is no longer in config.yaml, unscheduled'.format(news_site_uid))
+                del self._next_run[news_site_uid]
+        for news_site_uid in sites:
+            self._next_run.setdefault(news_site_uid, time.monotonic())
+
+    def _interval(self, news_site_uid):
+        settings = self._settings()
+        site_config = common.config()['news_sites'].get(news_site_uid, {})
+        minutes = site_config.get('interval_minutes', settings['interval_minutes'])
+
+        return minutes * 60 + random.uniform(0, settings['jitter_seconds'])
+
+    def _submit_due(self):
+        now = time.monotonic()
+        running = set(self._running.values())
+        for news_site_uid, due in self._next_run.items():
+            if due <= now and news_site_uid not in running:
+                logger.info('Starting scheduled run for {}'.format(news_site_uid))
+                future = self._submit(news_site_uid)
+                self._running[future] = news_site_uid
+
+    # Si un proceso del pool murió (por ejemplo, por falta de memoria), el
+    # pool queda roto: sus corridas en curso terminan con error y no acepta
+    # más. En ese caso se crea un pool nuevo.
+    def _submit(self, news_site_uid):
+        try:
+            return self._executor.submit(_run_site, news_site_uid, self._metrics_dir, self._workers)
+        except BrokenProcessPool:
+            logger.error('A worker process died, starting a new process pool')
+            self._executor.shutdown(wait = False)
+            self._executor = self._new_pool()
+            return self._executor.submit(_run_site, news_site_uid, self._metrics_dir, self._workers)
+
+    # Segundos hasta la siguiente revisión: la siguiente corrida programada o
+    # poll_seconds (para notar cambios en config.yaml), lo que pase primero.
+    def _wait_seconds(self):
+        wait_seconds = self._settings()['poll_seconds']
+        running = set(self._running.values())
+        for news_site_uid, due in self._next_run.items():
+            if news_site_uid not in running:
+                wait_seconds = min(wait_seconds, due - time.monotonic())
+
+        return max(0, wait_seconds)
+
+    # Espera a que termine alguna corrida (o a que pasen 'timeout' segundos),
+    # carga sus artículos y programa la siguiente corrida del sitio.
+    def _collect(self, timeout):
+        if not self._running:
+            time.sleep(timeout)
+            return
+
+        done, _ = wait(list(self._running), timeout = timeout, return_when = FIRST_COMPLETED)
+        for future in done:
+            news_site_uid = self._running.pop(future)
+            self._finish(news_site_uid, future)
+
+    def _finish(self, news_site_uid, future):
+        # Un sitio que falla no detiene al servicio; se vuelve a intentar en
+        # su siguiente turno.
+        try:
+            df, worker_metrics, watermark = future.result()
+            metrics.merge(worker_metrics)
+            if df is not None:
+                with pipeline._stage('load', news_site_uid, self._metrics_dir):
+                    pipeline._load(news_site_uid, df)
+            watermark.commit()
+        except Exception:
+            logger.exception('ETL failed for {}'.format(news_site_uid))
+            metrics.inc('etl_site_runs', site = news_site_uid, result = 'failed')
+        else:
+            metrics.inc('etl_site_runs', site = news_site_uid, result = 'ok')
+
+        if news_site_uid in self._next_run:
+            delay = self._interval(news_site_uid)
+            self._next_run[news_site_uid] = time.monotonic() + delay
+            logger.info('Next run for {} in {:.0f}s'.format(news_site_uid, delay))
+
+        # Las métricas se acumulan desde que arrancó el servicio.
+        pipeline._write_metrics(self._metrics_dir, self._started, self._sites(), mode = 'daemon')
+
+
+# Corre Extract y Transform de un sitio en un proceso del pool, con la
+# configuración más reciente.
+def _run_site(news_site_uid, metrics_dir, workers = 1):
+    _reload_config()
+    return pipeline._extract_and_transform(news_site_uid, metrics_dir, workers = workers)
+
+
+# Recarga config.yaml si cambió y, en ese caso, olvida las sesiones,
+# políticas de descarga y parsers construidos con la configuración anterior.
+def _reload_config():
+    if not common.reload_if_changed():
+        return False
+
+    news.reset_sites()
+    page_parser.reset_parsers()
+    return True
+
+
+# Los procesos del pool ignoran Ctrl+C: el proceso principal decide cuándo
+# parar y espera a que terminen los sitios en curso.
+def _ignore_interrupts():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    news_site_choices = list(common.config()['news_sites'].keys())
+    # Sitios a programar. Por defecto, todos los de config.yaml (incluidos los
+    # que se agreguen mientras el servicio corre).
+    parser.add_argument('--sites', help = 'News sites to schedule', nargs = '+', choices = news_site_choices)
+    # Número de sitios que se procesan en paralelo.
+    parser.add_argument('--jobs', help = 'Number of sites processed in parallel', type = int, default = os.cpu_count())
+    # Número de artículos que cada sitio descarga a la vez.
+    parser.add_argument('--workers', help = 'Number of articles fetched concurrently per site', type = int, default = 1)
+    parser.add_argument('--metrics-dir', help = 'Where metrics.prom and run_report.json are written',
+                        default = pipeline.DEFAULT_METRICS_DIR)
+    args = parser.parse_args()
+
+    daemon = CrawlDaemon(args.jobs, args.sites, args.metrics_dir, args.workers)
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    daemon.run()
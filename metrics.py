@@ -0,0 +1,208 @@
+# Métricas del ETL: contadores e histogramas en memoria, con exportación a
+# OpenMetrics (texto) y a un reporte JSON.
+#
+# Las etapas registran sus métricas con inc, observe, timer y track_rows. En
+# pipeline.py cada proceso del pool empieza su tarea con reset() y devuelve
+# snapshot(); el proceso principal las junta con merge() y al final escribe
+# los archivos con write_openmetrics y write_report.
+
+import cProfile
+import contextlib
+import functools
+import io
+import json
+import pstats
+import threading
+import time
+
+# Límites (en segundos) de los buckets de los histogramas.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def inc(name, value = 1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        if key not in _histograms:
+            _histograms[key] = {'buckets': [0] * len(DEFAULT_BUCKETS), 'sum': 0.0, 'count': 0}
+        histogram = _histograms[key]
+        for i, bound in enumerate(DEFAULT_BUCKETS):
+            if value <= bound:
+                histogram['buckets'][i] += 1
+                break
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+
+# Registra en el histograma 'name' cuánto tarda el bloque with.
+@contextlib.contextmanager
+def timer(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+# Decorador para las funciones que reciben un DataFrame como primer
+# argumento: suma su tiempo y sus filas en <stage>_seconds y <stage>_rows,
+# con la etiqueta function, para calcular filas por segundo.
+def track_rows(stage):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(df, *args, **kwargs):
+            start = time.perf_counter()
+            result = function(df, *args, **kwargs)
+            inc('{}_seconds'.format(stage), time.perf_counter() - start, function = function.__name__)
+            inc('{}_rows'.format(stage), len(df), function = function.__name__)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def snapshot():
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'histograms': {key: {'buckets': list(h['buckets']), 'sum': h['sum'], 'count': h['count']}
+                           for key, h in _histograms.items()},
+        }
+
+
+def merge(other):
+    with _lock:
+        for key, value in other['counters'].items():
+            _counters[key] = _counters.get(key, 0) + value
+        for key, h in other['histograms'].items():
+            if key not in _histograms:
+                _histograms[key] = {'buckets': [0] * len(DEFAULT_BUCKETS), 'sum': 0.0, 'count': 0}
+            mine = _histograms[key]
+            mine['buckets'] = [a + b for a, b in zip(mine['buckets'], h['buckets'])]
+            mine['sum'] += h['sum']
+            mine['count'] += h['count']
+
+
+def _format_labels(labels, extra = ()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    escaped = ('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for k, v in items)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+def write_openmetrics(path):
+    data = snapshot()
+    lines = []
+
+    names = sorted({name for name, _ in data['counters']})
+    for name in names:
+        lines.append('# TYPE {} counter'.format(name))
+        for (metric, labels), value in sorted(data['counters'].items()):
+            if metric == name:
+                lines.append('{}_total{} {}'.format(name, _format_labels(labels), value))
+
+    names = sorted({name for name, _ in data['histograms']})
+    for name in names:
+        lines.append('# TYPE {} histogram'.format(name))
+        for (metric, labels), h in sorted(data['histograms'].items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(DEFAULT_BUCKETS, h['buckets']):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(name, _format_labels(labels, [('le', _format_bound(bound))]),
+                                                     cumulative))
+            lines.append('{}_sum{} {}'.format(name, _format_labels(labels), h['sum']))
+            lines.append('{}_count{} {}'.format(name, _format_labels(labels), h['count']))
+
+    lines.append('# EOF')
+    with open(path, mode = 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+# Cuantil aproximado a partir de los buckets (el límite superior del bucket
+# donde cae el cuantil).
+def _quantile(h, q):
+    if not h['count']:
+        return None
+    target = q * h['count']
+    cumulative = 0
+    for bound, count in zip(DEFAULT_BUCKETS, h['buckets']):
+        cumulative += count
+        if cumulative >= target:
+            return bound if bound != float('inf') else None
+
+    return None
+
+
+# Reporte JSON de la corrida: contadores, resumen de cada histograma y las
+# filas por segundo de cada pareja <stage>_rows / <stage>_seconds.
+def write_report(path, **extra):
+    data = snapshot()
+    counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(data['counters'].items())]
+    histograms = [{'name': name, 'labels': dict(labels), 'count': h['count'], 'sum': h['sum'],
+                   'mean': h['sum'] / h['count'] if h['count'] else None,
+                   'p50': _quantile(h, 0.5), 'p95': _quantile(h, 0.95), 'p99': _quantile(h, 0.99)}
+                  for (name, labels), h in sorted(data['histograms'].items())]
+
+    rates = []
+    for (name, labels), rows in sorted(data['counters'].items()):
+        if name.endswith('_rows'):
+            seconds = data['counters'].get((name[:-len('_rows')] + '_seconds', labels))
+            if seconds:
+                rates.append({'name': name[:-len('_rows')] + '_rows_per_second', 'labels': dict(labels),
+                              'value': rows / seconds})
+
+    report = dict(extra, counters = counters, histograms = histograms, rates = rates)
+    with open(path, mode = 'w') as f:
+        json.dump(report, f, indent = 2)
+
+
+# Perfila el bloque with con cProfile si enabled es True, guarda las
+# estadísticas en 'path' (.pstats) y las funciones más costosas en el log.
+@contextlib.contextmanager
+def profiled(enabled, path, logger = None):
+    if not enabled:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        if logger is not None:
+            # Se escribe en el log y no en stdout, que en los procesos del pool
+            # se mezclaría con la salida de los demás.
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream = stream).sort_stats('cumulative').print_stats(25)
+            logger.info('Profile saved at {}\n{}'.format(path, stream.getvalue()))
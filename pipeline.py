@@ -1,70 +1,282 @@
+import argparse
+import contextlib
+import datetime
 import logging
 logging.basicConfig(level = logging.INFO)
-# La librería subprocess permite manipular archivos de terminal directamente.
-# Como tener la terminal directamente en Python.
-import subprocess
+import itertools
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from queue import Empty
+
+# Las tres etapas se importan como módulos, así que sus carpetas se agregan al
+# path. Load va primero para que 'test' sea Load/test.py y no el paquete 'test'
+# de la librería estándar.
+_root = os.path.dirname(os.path.abspath(__file__))
+for _stage in ('Extract', 'Transform', 'Load'):
+    sys.path.insert(0, os.path.join(_root, _stage))
+
+import pandas as pd
+
+from common import config
+import link_sources
+import main as extractor
+import newspaper_recipe
+import test as loader
+import metrics
 
 # Referencia a logger.
 logger = logging.getLogger(__name__)
 
-# Se especifican los sitios disponibles para scrapear.
-news_sites_uids = ['lajornada', 'milenio', 'sdpnoticias', 'unotv', 'elfinanciero']
+# Artículos por lote en el modo streaming.
+DEFAULT_BATCH_SIZE = 10
+# Segundos de espera en la cola del modo streaming antes de revisar si algún
+# proceso del pool murió sin avisar.
+QUEUE_POLL_SECONDS = 5
+# Carpeta donde se escriben metrics.prom, run_report.json y los perfiles.
+DEFAULT_METRICS_DIR = os.path.join(_root, 'metrics')
+STAGES = ('extract', 'transform', 'load')
 
-def main():
+
+# profile_stage: nombre de una etapa ('extract', 'transform' o 'load') que se
+# perfila con cProfile, o None. workers: artículos que cada sitio descarga a
+# la vez (ver extractor._fetch_articles).
+def main(news_sites_uids, jobs = 1, metrics_dir = DEFAULT_METRICS_DIR, profile_stage = None, workers = 1):
     logging.info('Launching ETL...')
-    _extract()
-    _transform()
-    _load()
-
-
-def _extract():
-    logging.info('Starting extraction process...')
-    # Para cada sitio de noticias:
-    for news_site_uid in news_sites_uids:
-        # Ejecuta el comando 'python main.py lajornada/milenio/...'.
-        # El parámetro cwd (current working directory) indica que la 
-        # operación se ejecute en la carpeta ./Extract.
-        subprocess.run(['python', 'main.py', news_site_uid], cwd = './Extract')
-        # Ejecuta el comando 'find . -name lajornada/milenio/...'. El punto indica
-        # que se comience a partir de este directorio (Extract/) y el parámetro
-        # -name indica que se busque con el siguiente patrón; en este caso, los nombres
-        # de los periódicos.
-        # La siguiente línea ejecuta la operación '-exec mv lajornada/milenio/... 
-        # ../Transform/lajornada_.csv'. -exec ejecuta un comando, que es mv, mover, 
-        # el archivo con el nombre lajornada/milenio/... a la carpeta Transform con un
-        # '_.csv' al final. find pide que termine en ';'
-        subprocess.run(['find', '.', '-name', '{}*'.format(news_site_uid),
-                        '-exec', 'mv', '{}', '../Transform/{}_.csv'.format(news_site_uid), ';'], cwd = './Extract')
-
-
-def _transform():
-    logging.info('Starting transform process...')
-    for news_site_uid in news_sites_uids:
-        dirty_data_filename = '{}_.csv'.format(news_site_uid)
-        clean_data_filename = 'clean_{}'.format(dirty_data_filename)
-        # Se ejecuta el comando 'python newspaper_recipe.py lajornada/milenio..._.csv'
-        # en la carpeta ./Transform.
-        subprocess.run(['python', 'newspaper_recipe.py', dirty_data_filename], cwd = './Transform')
-        # Se ejecuta el comando 'rm lajornada/milenio_.csv' en la carpeta ./Transform.
-        # Se elimina el archivo primigenio.
-        subprocess.run(['rm', dirty_data_filename], cwd = './Transform')
-        # Se ejecuta el comando 'mv clean_lajornada/milenio/..._.csv ../Load/
-        # lajornada/milenio/.csv' en la carpeta Transform. Se mueve el archivo creado 
-        # a la carpeta Load ya con el nombre definitivo. Ej: Load/lajornada.csv
-        subprocess.run(['mv', clean_data_filename, '../Load/{}.csv'.format(news_site_uid)], cwd = './Transform')
-
-
-def _load():
-    logger.info('Starting load process...')
-    for news_site_uid in news_sites_uids:
-        clean_data_filename = '{}.csv'.format(news_site_uid)
-        # Se ejecuta el comando 'python test.py lajornada.csv' en la carpeta Load.
-        # Se carga el archivo en la base de datos y somos felices.
-        subprocess.run(['python', 'test.py', clean_data_filename], cwd = './Load')
-        # Se ejecuta el comando 'rm lajornada.csv' en la carpeta Load.
-        # Se elimina el archivo .csv de todos los sitios de noticias.
-        #subprocess.run(['rm', clean_data_filename], cwd = './Load')
+    started = datetime.datetime.now()
+    metrics.reset()
+    # Extract y Transform de cada sitio corren en paralelo en un pool de
+    # procesos. Load se hace en este proceso, sitio por sitio, conforme van
+    # terminando, para no tener varios escritores sobre el mismo SQLite.
+    with ProcessPoolExecutor(max_workers = jobs) as executor:
+        futures = {executor.submit(_extract_and_transform, news_site_uid, metrics_dir, profile_stage, workers):
+                   news_site_uid for news_site_uid in news_sites_uids}
+
+        for future in as_completed(futures):
+            news_site_uid = futures[future]
+            # Un sitio que falla (en cualquier etapa, incluida la carga) no
+            # detiene a los demás, igual que cuando cada etapa era un
+            # subproceso independiente.
+            try:
+                df, worker_metrics, watermark = future.result()
+                # Las métricas del proceso del pool se suman a las de este.
+                metrics.merge(worker_metrics)
+                if df is not None:
+                    with _stage('load', news_site_uid, metrics_dir, profile_stage):
+                        _load(news_site_uid, df)
+                # La última corrida del sitio sólo avanza una vez cargado.
+                watermark.commit()
+            except Exception:
+                logger.exception('ETL failed for {}'.format(news_site_uid))
+                metrics.inc('etl_site_runs', site = news_site_uid, result = 'failed')
+                continue
+
+            metrics.inc('etl_site_runs', site = news_site_uid, result = 'ok')
+
+    _write_metrics(metrics_dir, started, news_sites_uids, mode = 'batch')
+
+
+# Modo streaming: cada sitio entrega lotes pequeños de artículos ya limpios a
+# una cola acotada y este proceso los inserta en cuanto llegan. Ningún sitio
+# tiene en memoria más de un lote a la vez, y la cola (de tamaño fijo) frena a
+# los productores si la carga se atrasa.
+def main_stream(news_sites_uids, jobs = 1, batch_size = DEFAULT_BATCH_SIZE,
+                metrics_dir = DEFAULT_METRICS_DIR, profile_stage = None, workers = 1):
+    logging.info('Launching streaming ETL...')
+    started = datetime.datetime.now()
+    metrics.reset()
+    with multiprocessing.Manager() as manager:
+        queue = manager.Queue(maxsize = 2 * jobs)
+        with ProcessPoolExecutor(max_workers = jobs) as executor:
+            futures = {executor.submit(_stream_site, news_site_uid, batch_size, queue, metrics_dir, profile_stage,
+                                       workers): news_site_uid
+                       for news_site_uid in news_sites_uids}
+
+            # Cada sitio manda (news_site_uid, None, métricas) al terminar,
+            # con o sin error. Un lote que no se puede cargar se registra y la
+            # cola se sigue vaciando; si se dejara de leer, los productores se
+            # quedarían bloqueados en queue.put y el pool nunca terminaría.
+            # Un proceso que muere (por falta de memoria o una señal) no manda
+            # ese aviso: si la cola está vacía y el future de un sitio ya
+            # terminó (con BrokenProcessPool, por ejemplo), el sitio se da por
+            # terminado.
+            finished = set()
+            load_failed = set()
+            while len(finished) < len(futures):
+                try:
+                    news_site_uid, df, worker_metrics = queue.get(timeout = QUEUE_POLL_SECONDS)
+                except Empty:
+                    for future, news_site_uid in futures.items():
+                        if news_site_uid not in finished and future.done():
+                            finished.add(news_site_uid)
+                    continue
+
+                if df is None:
+                    metrics.merge(worker_metrics)
+                    finished.add(news_site_uid)
+                    continue
+
+                try:
+                    with _stage('load', news_site_uid, metrics_dir, profile_stage):
+                        _load(news_site_uid, df)
+                except Exception:
+                    logger.exception('Load failed for a batch of {}'.format(news_site_uid))
+                    load_failed.add(news_site_uid)
+
+            for future, news_site_uid in futures.items():
+                result = 'ok'
+                if future.exception():
+                    logger.error('ETL failed for {}'.format(news_site_uid), exc_info = future.exception())
+                    result = 'failed'
+                elif news_site_uid in load_failed:
+                    result = 'failed'
+                else:
+                    # La última corrida del sitio sólo avanza si todos sus
+                    # lotes se cargaron.
+                    future.result().commit()
+                metrics.inc('etl_site_runs', site = news_site_uid, result = result)
+
+    _write_metrics(metrics_dir, started, news_sites_uids, mode = 'stream')
+
+
+# Extract y Transform de un sitio en lotes de batch_size artículos. Se ejecuta
+# dentro de un proceso del pool, pone cada lote limpio en la cola y devuelve
+# la link_sources.Watermark del sitio para confirmarla después de la carga.
+def _stream_site(news_site_uid, batch_size, queue, metrics_dir = DEFAULT_METRICS_DIR, profile_stage = None,
+                 workers = 1):
+    metrics.reset()
+    watermark = link_sources.Watermark(news_site_uid)
+    # Títulos ya vistos en lotes anteriores del mismo sitio.
+    seen_headlines = set()
+    try:
+        batches = _batched(extractor._iter_articles(news_site_uid, workers, watermark = watermark), batch_size)
+        while True:
+            with _stage('extract', news_site_uid, metrics_dir, profile_stage):
+                batch = next(batches, None)
+            if batch is None:
+                break
+
+            with _stage('transform', news_site_uid, metrics_dir, profile_stage):
+                df = newspaper_recipe.transform(_articles_to_df(batch), news_site_uid, seen_headlines)
+            if len(df):
+                queue.put((news_site_uid, df, None))
+    finally:
+        queue.put((news_site_uid, None, metrics.snapshot()))
+
+    return watermark
+
+
+# Agrupa un iterable en listas de hasta 'size' elementos, sin consumirlo
+# completo.
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+# Extract y Transform de un sitio. Se ejecuta dentro de un proceso del pool y
+# devuelve el DataFrame limpio (o None si no hubo artículos) junto con las
+# métricas que se registraron en el proceso durante la tarea y la
+# link_sources.Watermark del sitio, que se confirma después de la carga.
+def _extract_and_transform(news_site_uid, metrics_dir = DEFAULT_METRICS_DIR, profile_stage = None, workers = 1):
+    metrics.reset()
+    watermark = link_sources.Watermark(news_site_uid)
+    with _stage('extract', news_site_uid, metrics_dir, profile_stage):
+        df = _extract(news_site_uid, watermark, workers)
+    if df is None:
+        return None, metrics.snapshot(), watermark
+
+    with _stage('transform', news_site_uid, metrics_dir, profile_stage):
+        df = _transform(news_site_uid, df)
+
+    return df, metrics.snapshot(), watermark
+
+
+# Mide una etapa de un sitio en el histograma etl_stage_seconds y, si es la
+# etapa elegida con --profile-stage, la perfila con cProfile. En el modo
+# streaming una etapa se repite por lote, y cada lote reescribe el perfil.
+@contextlib.contextmanager
+def _stage(stage, news_site_uid, metrics_dir = DEFAULT_METRICS_DIR, profile_stage = None):
+    profile_path = os.path.join(metrics_dir, 'profile_{}_{}.pstats'.format(stage, news_site_uid))
+    if stage == profile_stage:
+        os.makedirs(metrics_dir, exist_ok = True)
+
+    with metrics.timer('etl_stage_seconds', stage = stage, site = news_site_uid), \
+         metrics.profiled(stage == profile_stage, profile_path, logger):
+        yield
+
+
+# Escribe las métricas de la corrida en metrics_dir: metrics.prom (formato
+# OpenMetrics) y run_report.json.
+def _write_metrics(metrics_dir, started, news_sites_uids, mode):
+    os.makedirs(metrics_dir, exist_ok = True)
+    finished = datetime.datetime.now()
+    metrics.write_openmetrics(os.path.join(metrics_dir, 'metrics.prom'))
+    metrics.write_report(os.path.join(metrics_dir, 'run_report.json'),
+                         mode = mode,
+                         sites = list(news_sites_uids),
+                         started = started.isoformat(),
+                         finished = finished.isoformat(),
+                         seconds = (finished - started).total_seconds())
+    logger.info('Metrics written to {}'.format(metrics_dir))
+
+
+def _extract(news_site_uid, watermark = None, workers = 1):
+    logging.info('Starting extraction process for {}...'.format(news_site_uid))
+    articles = extractor._news_scraper(news_site_uid, workers, save = False, watermark = watermark)
+    if not articles:
+        logger.warning('No articles fetched for {}'.format(news_site_uid))
+        return None
+
+    return _articles_to_df(articles)
+
+
+def _transform(news_site_uid, df):
+    logging.info('Starting transform process for {}...'.format(news_site_uid))
+    return newspaper_recipe.transform(df, news_site_uid)
+
+
+# Las notas casi repetidas se quitan aquí, en el proceso que carga y un sitio
+# a la vez, para comparar también con las de los demás sitios de la corrida.
+# El índice sólo se actualiza si la carga termina bien.
+def _load(news_site_uid, df):
+    logger.info('Starting load process for {}...'.format(news_site_uid))
+    with newspaper_recipe.without_near_duplicates(df) as df:
+        loader.load(df)
+
+
+# Convierte los artículos en el mismo DataFrame que newspaper_recipe obtendría
+# al leer el .csv de Extract: las cadenas vacías se vuelven NaN, tal como lo
+# hace pd.read_csv, para que _fill_missing_titles las detecte.
+def _articles_to_df(articles):
+    # Los ArticleRecord son tuplas con los campos en el orden de ARTICLE_SCHEMA.
+    return pd.DataFrame(list(articles), columns = list(extractor.ARTICLE_SCHEMA)).replace('', float('nan'))
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser()
+    news_site_choices = list(config()['news_sites'].keys())
+    # Sitios a procesar. Por defecto, todos los de config.yaml.
+    parser.add_argument('--sites', help = 'News sites to run through the ETL', nargs = '+',
+                        choices = news_site_choices, default = news_site_choices)
+    # Número de sitios que se procesan en paralelo.
+    parser.add_argument('--jobs', help = 'Number of sites processed in parallel', type = int, default = os.cpu_count())
+    # Número de artículos que cada sitio descarga a la vez.
+    parser.add_argument('--workers', help = 'Number of articles fetched concurrently per site', type = int, default = 1)
+    # Procesa y carga los artículos en lotes conforme se descargan.
+    parser.add_argument('--stream', help = 'Stream articles through the ETL in small batches', action = 'store_true')
+    parser.add_argument('--batch-size', help = 'Articles per batch in streaming mode', type = int, default = DEFAULT_BATCH_SIZE)
+    # Métricas y perfil de una etapa.
+    parser.add_argument('--metrics-dir', help = 'Where metrics.prom and run_report.json are written',
+                        default = DEFAULT_METRICS_DIR)
+    parser.add_argument('--profile-stage', help = 'Profile one stage with cProfile', choices = STAGES)
+    args = parser.parse_args()
+
+    if args.stream:
+        main_stream(args.sites, args.jobs, args.batch_size, args.metrics_dir, args.profile_stage, args.workers)
+    else:
+        main(args.sites, args.jobs, args.metrics_dir, args.profile_stage, args.workers)
@@ -0,0 +1,16 @@
+# Lista de palabras clave vacías (stopwords) de nltk que comparten las etapas:
+# newspaper_recipe la usa para contar tokens y Load/search.py para normalizar
+# el índice de búsqueda, así que un cambio de idioma afecta a las dos.
+
+import functools
+
+from nltk.corpus import stopwords
+
+# Idioma de la lista de palabras clave (stopwords) de nltk.
+STOPWORDS_LANGUAGE = 'spanish'
+
+
+# Palabras vacías del idioma, leídas una sola vez por proceso.
+@functools.lru_cache(maxsize = None)
+def stop_words():
+    return frozenset(stopwords.words(STOPWORDS_LANGUAGE))